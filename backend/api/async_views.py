@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.permissions import SAFE_METHODS
+
+ASYNC_READ_ACTIONS = ('list', 'retrieve')
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_READ_THREADS,
+            thread_name_prefix='async-read'
+        )
+    return _executor
+
+
+def _call_view(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if not response.streaming and hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+class AsyncReadMixin:
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if (not settings.ASYNC_READ_VIEWS
+                or not set(ASYNC_READ_ACTIONS) & set(actions.values())):
+            return view
+
+        async def async_view(request, *args, **kwargs):
+            if request.method in SAFE_METHODS:
+                run = sync_to_async(
+                    partial(_call_view, view),
+                    thread_sensitive=False,
+                    executor=get_executor()
+                )
+            else:
+                run = sync_to_async(view, thread_sensitive=True)
+            return await run(request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
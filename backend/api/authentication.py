@@ -0,0 +1,98 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from recipe.versions import bump_version_on_commit
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+CREDENTIAL_FIELDS = ('password', 'is_active', 'is_staff', 'is_superuser')
+
+
+def token_auth_version(key):
+    return f'token_auth_version:{key}'
+
+
+class TokenCache:
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, entry_generation, value = entry
+                if (entry_generation == generation
+                        and expires > time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation):
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + self.ttl, generation, value
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+
+token_cache = TokenCache(
+    settings.TOKEN_AUTH_CACHE_SIZE, settings.TOKEN_AUTH_CACHE_TTL
+)
+
+
+def invalidate_token_cache(keys):
+    for key in keys:
+        bump_version_on_commit(token_auth_version(key))
+
+
+def invalidate_user_tokens(user_id):
+    invalidate_token_cache(
+        Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        generation = cache.get(token_auth_version(key), 0)
+        credentials = token_cache.get(key, generation)
+        if credentials is None and settings.TOKEN_AUTH_CACHE_SHARED:
+            credentials = cache.get(f'token_auth:{generation}:{key}')
+            if credentials is not None:
+                token_cache.set(key, credentials, generation)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials, generation)
+            if settings.TOKEN_AUTH_CACHE_SHARED:
+                cache.set(
+                    f'token_auth:{generation}:{key}',
+                    credentials,
+                    timeout=settings.TOKEN_AUTH_CACHE_TTL
+                )
+        user, token = credentials
+        return (copy.copy(user), token)
@@ -0,0 +1,324 @@
+import math
+import platform
+import statistics
+import subprocess
+import time
+from collections import namedtuple
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from recipe.models import (
+    Cart,
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    Tag
+)
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+Route = namedtuple(
+    'Route',
+    ('name', 'method', 'path', 'authenticated', 'rollback', 'user', 'data'),
+    defaults=(None, None)
+)
+
+PERCENTILES = (50, 90, 95, 99)
+BULK_ROUTE_SIZE = 20
+PANTRY_ROUTE_EXTRA = 10
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * percent / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def dataset_stats():
+    return {
+        'users': User.objects.count(),
+        'recipes': Recipe.objects.count(),
+        'ingredients': Ingredient.objects.count(),
+        'tags': Tag.objects.count(),
+        'favorites': Favorite.objects.count(),
+        'carts': Cart.objects.count(),
+        'follows': Follow.objects.count(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def benchmark_user(email=None):
+    if email:
+        return User.objects.get(email=email)
+    return (
+        User.objects
+        .annotate(carts=Count('cart_user', distinct=True),
+                  follows=Count('follower', distinct=True))
+        .order_by('-carts', '-follows', 'id')
+        .first()
+    )
+
+
+def wide_follower():
+    return (
+        User.objects
+        .annotate(follows=Count('follower'))
+        .order_by('-follows', 'id')
+        .first()
+    )
+
+
+def build_routes(user):
+    recipe = Recipe.objects.exclude(author=user).order_by('id').first()
+    ingredient = Ingredient.objects.order_by('id').first()
+    tags = list(Tag.objects.order_by('id'))
+    author = (
+        User.objects
+        .annotate(recipes_count=Count('recipes'))
+        .order_by('-recipes_count', 'id')
+        .first()
+    )
+    routes = [
+        Route('tags-list', 'get', '/api/tags/', False, False),
+        Route('ingredients-list', 'get', '/api/ingredients/', False, False),
+        Route('recipes-list', 'get', '/api/recipes/', False, False),
+        Route('recipes-list-auth', 'get', '/api/recipes/', True, False),
+        Route('recipes-list-page', 'get', '/api/recipes/?page=3',
+              False, False),
+        Route('recipes-list-cursor', 'get', '/api/recipes/?cursor=',
+              False, False),
+        Route('recipes-list-popular', 'get',
+              '/api/recipes/?ordering=popular&cursor=', False, False),
+        Route('recipes-list-favorited', 'get',
+              '/api/recipes/?is_favorited=1', True, False),
+        Route('recipes-list-in-cart', 'get',
+              '/api/recipes/?is_in_shopping_cart=1', True, False),
+        Route('recipes-feed', 'get', '/api/recipes/feed/', True, False),
+        Route('users-list', 'get', '/api/users/', False, False),
+        Route('users-me', 'get', '/api/users/me/', True, False),
+        Route('users-subscriptions', 'get',
+              '/api/users/subscriptions/?recipes_limit=3', True, False),
+        Route('recipes-download-shopping-cart', 'get',
+              '/api/recipes/download_shopping_cart/', True, True),
+    ]
+    if tags:
+        routes.append(Route('tags-detail', 'get', f'/api/tags/{tags[0].id}/',
+                            False, False))
+        query = '&'.join(f'tags={tag.slug}' for tag in tags[:2])
+        routes.append(Route('recipes-list-tags', 'get',
+                            f'/api/recipes/?{query}', False, False))
+    if ingredient:
+        routes.append(Route('ingredients-detail', 'get',
+                            f'/api/ingredients/{ingredient.id}/',
+                            False, False))
+        routes.append(Route('ingredients-search', 'get',
+                            f'/api/ingredients/?name={ingredient.name[:3]}',
+                            False, False))
+    if author:
+        routes.append(Route('recipes-list-author', 'get',
+                            f'/api/recipes/?author={author.id}',
+                            False, False))
+        routes.append(Route('users-detail', 'get',
+                            f'/api/users/{author.id}/', True, False))
+        if author != user:
+            routes.append(Route('users-subscribe', 'post',
+                                f'/api/users/{author.id}/subscribe/',
+                                True, True))
+    author_ids = list(
+        User.objects
+        .filter(id__in=Recipe.objects.values('author_id'))
+        .exclude(id=user.id)
+        .order_by('id')
+        .values_list('id', flat=True)[:BULK_ROUTE_SIZE]
+    )
+    if author_ids:
+        routes.append(Route('users-subscribe-bulk', 'post',
+                            '/api/users/subscribe/', True, True,
+                            data={'ids': author_ids}))
+    follower = wide_follower()
+    if follower and follower != user and (
+        follower.follows > Follow.objects.filter(user=user).count()
+    ):
+        routes.append(Route('recipes-feed-wide', 'get', '/api/recipes/feed/',
+                            True, False, follower))
+    if recipe:
+        routes.extend((
+            Route('recipes-detail', 'get', f'/api/recipes/{recipe.id}/',
+                  False, False),
+            Route('recipes-detail-auth', 'get',
+                  f'/api/recipes/{recipe.id}/', True, False),
+            Route('recipes-similar', 'get',
+                  f'/api/recipes/{recipe.id}/similar/', False, False),
+            Route('recipes-favorite', 'post',
+                  f'/api/recipes/{recipe.id}/favorite/', True, True),
+            Route('recipes-shopping-cart', 'post',
+                  f'/api/recipes/{recipe.id}/shopping_cart/', True, True),
+        ))
+        recipe_ids = list(
+            Recipe.objects
+            .exclude(author=user)
+            .order_by('id')
+            .values_list('id', flat=True)[:BULK_ROUTE_SIZE]
+        )
+        routes.extend((
+            Route('recipes-favorite-bulk', 'post', '/api/recipes/favorite/',
+                  True, True, data={'ids': recipe_ids}),
+            Route('recipes-shopping-cart-bulk', 'post',
+                  '/api/recipes/shopping_cart/', True, True,
+                  data={'ids': recipe_ids}),
+        ))
+        pantry = list(
+            IngredientRecipe.objects
+            .filter(recipe=recipe)
+            .values_list('ingredient_id', flat=True)
+        ) + list(
+            Ingredient.objects
+            .annotate(recipes_count=Count('ingredientrecipe'))
+            .order_by('-recipes_count', 'id')
+            .values_list('id', flat=True)[:PANTRY_ROUTE_EXTRA]
+        )
+        query = '&'.join(
+            f'ingredients={ingredient_id}'
+            for ingredient_id in dict.fromkeys(pantry)
+        )
+        routes.append(Route('recipes-pantry', 'get',
+                            f'/api/recipes/pantry/?{query}&missing=2',
+                            False, False))
+    return sorted(routes, key=lambda route: route.name)
+
+
+class Benchmark:
+
+    def __init__(self, user, iterations=20, warmup=3, cold=False):
+        self.user = user
+        self.iterations = iterations
+        self.warmup = warmup
+        self.cold = cold
+        host = next(
+            (host for host in settings.ALLOWED_HOSTS
+             if host and '*' not in host and not host.startswith('.')),
+            'localhost'
+        )
+        self.host = host
+        self.anonymous = Client(SERVER_NAME=host)
+        self.authenticated = self._client(user)
+        self.clients = {user.id: self.authenticated}
+
+    def _client(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(
+            SERVER_NAME=self.host, HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+
+    def _request(self, route):
+        client = self.authenticated if route.authenticated else self.anonymous
+        if route.user is not None:
+            if route.user.id not in self.clients:
+                self.clients[route.user.id] = self._client(route.user)
+            client = self.clients[route.user.id]
+        if self.cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            if route.data is None:
+                response = getattr(client, route.method)(route.path)
+            else:
+                response = getattr(client, route.method)(
+                    route.path, route.data, content_type='application/json'
+                )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed * 1000, len(queries)
+
+    def _measure(self, route):
+        if not route.rollback:
+            return self._request(route)
+        with transaction.atomic():
+            result = self._request(route)
+            transaction.set_rollback(True)
+        return result
+
+    def run_route(self, route):
+        for _ in range(self.warmup):
+            self._measure(route)
+        timings, queries, statuses = [], [], set()
+        for _ in range(self.iterations):
+            status_code, elapsed, query_count = self._measure(route)
+            statuses.add(status_code)
+            timings.append(elapsed)
+            queries.append(query_count)
+        result = {
+            'method': route.method.upper(),
+            'path': route.path,
+            'authenticated': route.authenticated,
+            'user': route.user.id if route.user else None,
+            'status': sorted(statuses),
+            'queries': max(queries),
+            'min_ms': round(min(timings), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'max_ms': round(max(timings), 3),
+        }
+        for percent in PERCENTILES:
+            result[f'p{percent}_ms'] = round(percentile(timings, percent), 3)
+        return result
+
+    def run(self, routes, only=None):
+        results = {}
+        for route in routes:
+            if only and not any(name in route.name for name in only):
+                continue
+            results[route.name] = self.run_route(route)
+        return {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'iterations': self.iterations,
+                'warmup': self.warmup,
+                'cold': self.cold,
+                'user': self.user.id,
+                'dataset': dataset_stats(),
+            },
+            'results': results,
+        }
+
+
+def compare(baseline, current, metric='p95_ms'):
+    rows = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            rows.append((name, None, result[metric], None,
+                         None, result['queries']))
+            continue
+        change = (
+            (result[metric] - before[metric]) / before[metric] * 100
+            if before[metric] else 0
+        )
+        rows.append((name, before[metric], result[metric], change,
+                     before['queries'], result['queries']))
+    return rows
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from recipe.models import Recipe
+from recipe.versions import (
+    RECIPES_VERSION,
+    get_last_modified,
+    get_version,
+    user_relations_version
+)
+from rest_framework.response import Response
+
+LOCK_POLL_INTERVAL = 0.05
+
+
+class AnonymousResponseCacheMixin:
+    cache_query_params = (
+        'tags', 'author', 'page', 'limit', 'cursor', 'count', 'search'
+    )
+    cache_prefix = 'recipes'
+
+    def _response_cache_key(self, request, kwargs):
+        params = request.query_params
+        if set(params) - set(self.cache_query_params):
+            return None
+        normalized = [
+            (name, sorted(params.getlist(name)))
+            for name in self.cache_query_params
+            if name in params
+        ]
+        digest = hashlib.md5(
+            json.dumps(
+                [request.get_host(), self.action, kwargs, normalized]
+            ).encode()
+        ).hexdigest()
+        return '{}:{}:{}'.format(
+            self.cache_prefix, get_version(RECIPES_VERSION), digest
+        )
+
+    def _wait_for(self, key):
+        deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            data = cache.get(key)
+            if data is not None:
+                return data
+        return None
+
+    def _cached_response(self, request, compute, kwargs):
+        if request.user.is_authenticated:
+            return compute()
+        key = self._response_cache_key(request, kwargs)
+        if key is None:
+            return compute()
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        lock_key = key + ':lock'
+        locked = cache.add(
+            lock_key, 1, timeout=settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        )
+        if not locked:
+            data = self._wait_for(key)
+            if data is not None:
+                return Response(data)
+        try:
+            response = compute()
+            if response.status_code == 200:
+                cache.set(
+                    key, response.data, timeout=settings.RESPONSE_CACHE_TIMEOUT
+                )
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(
+            request, partial(super().list, request, *args, **kwargs), kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            request,
+            partial(super().retrieve, request, *args, **kwargs),
+            kwargs
+        )
+
+
+class ConditionalGetMixin:
+    volatile_query_params = ('ordering',)
+
+    def _relations_version(self, request):
+        if not request.user.is_authenticated:
+            return None
+        return get_version(user_relations_version(request.user.id))
+
+    def _conditional_response(self, request, compute, etag, last_modified):
+        if request.user.is_authenticated:
+            last_modified = None
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            patch_vary_headers(not_modified, ('Authorization',))
+            return not_modified
+        response = compute()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def _make_etag(self, *parts):
+        return quote_etag(hashlib.md5(
+            json.dumps(parts, default=str).encode()
+        ).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        if set(request.query_params) & set(self.volatile_query_params):
+            return super().list(request, *args, **kwargs)
+        etag = self._make_etag(
+            get_version(RECIPES_VERSION),
+            self._relations_version(request),
+            request.get_full_path()
+        )
+        return self._conditional_response(
+            request,
+            partial(super().list, request, *args, **kwargs),
+            etag,
+            get_last_modified(RECIPES_VERSION)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            updated_at = (
+                Recipe.objects
+                .filter(pk=kwargs[self.lookup_url_kwarg or self.lookup_field])
+                .values_list('updated_at', flat=True)
+                .first()
+            )
+        except (TypeError, ValueError):
+            updated_at = None
+        compute = partial(super().retrieve, request, *args, **kwargs)
+        if updated_at is None:
+            return compute()
+        etag = self._make_etag(
+            kwargs, updated_at, self._relations_version(request)
+        )
+        return self._conditional_response(
+            request, compute, etag, int(updated_at.timestamp())
+        )
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def shared_cache_check(app_configs, **kwargs):
+    if settings.CACHE_SHARED or settings.DEBUG:
+        return []
+    return [Warning(
+        'Кэш хранится в памяти процесса: версии и инвалидация из других '
+        'воркеров и из manage.py не видны запущенному серверу.',
+        hint='Задайте CACHE_BACKEND и CACHE_LOCATION (Memcached или '
+             'DatabaseCache).',
+        id='api.W001'
+    )]
@@ -0,0 +1,33 @@
+import filetype
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64FileField
+from rest_framework import serializers
+
+
+class Base64ImageUploadField(Base64FileField):
+    ALLOWED_TYPES = ('jpg', 'png', 'gif', 'webp')
+    INVALID_FILE_MESSAGE = 'Загрузите корректное изображение.'
+    INVALID_TYPE_MESSAGE = 'Неподдерживаемый формат изображения.'
+
+    def get_file_extension(self, filename, decoded_file):
+        extension = filetype.guess_extension(decoded_file)
+        return 'jpg' if extension == 'jpeg' else extension
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image_variants')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        variants = {}
+        for size, files in (value or {}).items():
+            variants[size] = {}
+            for extension, name in files.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                variants[size][extension] = url
+        return variants
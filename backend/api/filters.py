@@ -1,9 +1,35 @@
-from django_filters.rest_framework import (
-    FilterSet,
-    ModelMultipleChoiceFilter,
-    filters
-)
-from recipe.models import Cart, Favorite, Recipe, Tag, User
+import threading
+
+from django.db.models import F
+from django_filters.rest_framework import FilterSet, filters
+from recipe.models import TAGS_MASK_BITS, Recipe, Tag, User, tags_mask
+from recipe.versions import TAGS_VERSION, get_version
+
+from api.relations import get_relations
+
+
+class TagSlugMap:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = {}
+
+    def get(self):
+        version = get_version(TAGS_VERSION)
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._ids = dict(Tag.objects.values_list('slug', 'id'))
+                    self._version = version
+        return self._ids
+
+
+tag_slug_map = TagSlugMap()
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_slug_map.get()]
 
 
 class RecipeFilter(FilterSet):
@@ -14,33 +40,54 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
-    tags = ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags'
+    )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'Сначала популярные'),),
+        method='filter_ordering'
     )
 
     def filter_is_favorited(self, queryset, name, value):
-        user = self.request.user
         if value:
-            favorites = Favorite.objects.filter(user=user).values_list(
-                'recipe'
+            return queryset.filter(
+                id__in=get_relations(self.request).favorites
             )
-            return queryset.filter(id__in=favorites)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
         if value:
-            cart_items = Cart.objects.filter(user=user).values_list('recipe')
-            return queryset.filter(id__in=cart_items)
+            return queryset.filter(id__in=get_relations(self.request).carts)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value)
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.popular()
+
+    def filter_tags(self, queryset, name, value):
+        slug_ids = tag_slug_map.get()
+        tag_ids = [slug_ids[slug] for slug in value if slug in slug_ids]
+        if any(tag_id >= TAGS_MASK_BITS for tag_id in tag_ids):
+            return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+                tag_id__in=tag_ids
+            ).values('recipe_id'))
+        return queryset.alias(
+            tag_hits=F('tags_mask').bitand(tags_mask(tag_ids))
+        ).filter(tag_hits__gt=0)
+
     class Meta:
         model = Recipe
         fields = (
             'tags',
             'is_favorited',
             'is_in_shopping_cart',
-            'author'
+            'author',
+            'search',
+            'ordering'
         )
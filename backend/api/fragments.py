@@ -0,0 +1,86 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from recipe.models import Recipe
+from rest_framework.response import Response
+
+from api.relations import get_relations
+from api.serializers import RecipeSerializer
+
+FRAGMENT_FIELDS = ('id', 'author', 'updated_at', 'favorites_count')
+
+
+def fragment_key(recipe, base_url):
+    return 'recipe_fragment:{}:{}:{}'.format(
+        recipe.id,
+        recipe.updated_at.timestamp(),
+        hashlib.md5(base_url.encode()).hexdigest()[:8]
+    )
+
+
+def _render_fragments(recipe_ids, request, base_url):
+    recipes = list(
+        Recipe.objects
+        .with_related()
+        .select_related('author')
+        .filter(id__in=recipe_ids)
+    )
+    for recipe in recipes:
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author.is_subscribed = False
+    data = RecipeSerializer(
+        recipes, many=True, context={'request': request}
+    ).data
+    fragments = {}
+    for recipe, item in zip(recipes, data):
+        item = dict(item)
+        item['author'] = dict(item['author'])
+        fragments[fragment_key(recipe, base_url)] = item
+    cache.set_many(
+        fragments, timeout=settings.RECIPE_FRAGMENT_CACHE_TIMEOUT
+    )
+    return {item['id']: item for item in fragments.values()}
+
+
+def render_recipes(recipes, request):
+    base_url = request.build_absolute_uri('/')
+    keys = {recipe.id: fragment_key(recipe, base_url) for recipe in recipes}
+    cached = cache.get_many(keys.values())
+    fragments = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items() if key in cached
+    }
+    missing = keys.keys() - fragments.keys()
+    if missing:
+        fragments.update(_render_fragments(missing, request, base_url))
+
+    relations = get_relations(request)
+    data = []
+    for recipe in recipes:
+        if recipe.id not in fragments:
+            continue
+        item = dict(fragments[recipe.id])
+        item['author'] = dict(
+            item['author'],
+            is_subscribed=recipe.author_id in relations.follows
+        )
+        item['is_favorited'] = recipe.id in relations.favorites
+        item['is_in_shopping_cart'] = recipe.id in relations.carts
+        data.append(item)
+    return data
+
+
+class RecipeFragmentMixin:
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(
+            self.get_queryset()
+        ).only(*FRAGMENT_FIELDS)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_recipes(page, request))
+        return Response(render_recipes(list(queryset), request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(render_recipes([self.get_object()], request)[0])
@@ -0,0 +1,118 @@
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from recipe.models import Ingredient
+from recipe.versions import bump_version_on_commit, get_version
+
+INGREDIENTS_VERSION = 'ingredient_index_version'
+FUZZY_THRESHOLD = 0.3
+
+
+def normalize(value):
+    return value.strip().lower().replace('ё', 'е')
+
+
+def trigrams(value):
+    padded = f'  {value} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+IndexState = namedtuple(
+    'IndexState', ('version', 'keys', 'rows', 'trigrams', 'postings')
+)
+
+EMPTY_STATE = IndexState(None, [], [], [], {})
+
+
+class IngredientIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = EMPTY_STATE
+
+    def _build(self, version):
+        rows = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (normalize(row['name']), row['id'])
+        )
+        keys = [normalize(row['name']) for row in rows]
+        key_trigrams = [trigrams(key) for key in keys]
+        postings = defaultdict(list)
+        for position, grams in enumerate(key_trigrams):
+            for gram in grams:
+                postings[gram].append(position)
+        return IndexState(
+            version=version,
+            keys=keys,
+            rows=rows,
+            trigrams=key_trigrams,
+            postings=dict(postings)
+        )
+
+    def _ensure_fresh(self):
+        version = get_version(INGREDIENTS_VERSION)
+        state = self._state
+        if state.version == version:
+            return state
+        with self._lock:
+            state = self._state
+            if state.version != version:
+                state = self._build(version)
+                self._state = state
+        return state
+
+    def search(self, query, limit=None):
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        if not query:
+            return []
+        state = self._ensure_fresh()
+        keys = state.keys
+        found = []
+        seen = set()
+
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(position)
+            seen.add(position)
+            position += 1
+
+        if len(found) < limit:
+            for position, key in enumerate(keys):
+                if position not in seen and query in key:
+                    found.append(position)
+                    seen.add(position)
+                    if len(found) == limit:
+                        break
+
+        if len(found) < limit:
+            query_grams = trigrams(query)
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(state.postings.get(gram, ()))
+            scored = []
+            for position, common in shared.items():
+                if position in seen:
+                    continue
+                similarity = common / (
+                    len(query_grams) + len(state.trigrams[position]) - common
+                )
+                if similarity >= FUZZY_THRESHOLD:
+                    scored.append((-similarity, keys[position], position))
+            scored.sort()
+            found.extend(
+                position for _, _, position in scored[:limit - len(found)]
+            )
+
+        return [state.rows[position] for position in found]
+
+
+def invalidate_ingredient_index():
+    bump_version_on_commit(INGREDIENTS_VERSION)
+
+
+ingredient_index = IngredientIndex()
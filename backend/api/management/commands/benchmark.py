@@ -0,0 +1,108 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from users.models import User
+
+from api.benchmark import Benchmark, benchmark_user, build_routes, compare
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку (перцентили) и число SQL-запросов '
+            'для маршрутов API и сохраняет результат в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кэш перед каждым запросом.'
+        )
+        parser.add_argument(
+            '--user',
+            help='Email пользователя для авторизованных запросов.'
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            help='Замерять только маршруты, в имени которых есть подстрока.'
+        )
+        parser.add_argument('--output', help='Куда сохранить JSON.')
+        parser.add_argument(
+            '--compare',
+            help='JSON предыдущего прогона для сравнения.'
+        )
+        parser.add_argument(
+            '--metric',
+            default='p95_ms',
+            choices=('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'mean_ms')
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            help='Завершиться с ошибкой, если метрика выросла больше, '
+                 'чем на указанный процент, или выросло число запросов.'
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('Нужна хотя бы одна итерация.')
+        try:
+            user = benchmark_user(options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["user"]} не найден.')
+        if user is None:
+            raise CommandError('База пуста, сначала выполните seed_data.')
+
+        report = Benchmark(
+            user,
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            cold=options['cold']
+        ).run(build_routes(user), only=options['only'])
+
+        metric = options['metric']
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f'{name:<34} {result[metric]:>9.2f} мс '
+                f'p50 {result["p50_ms"]:>8.2f}  '
+                f'запросов {result["queries"]:>3}  '
+                f'{",".join(map(str, result["status"]))}'
+            )
+        if options['output']:
+            Path(options['output']).write_text(
+                json.dumps(report, ensure_ascii=False, indent=2)
+            )
+            self.stdout.write(f'Результат сохранён в {options["output"]}.')
+        if options['compare']:
+            self._compare(report, options)
+
+    def _compare(self, report, options):
+        baseline = json.loads(Path(options['compare']).read_text())
+        metric = options['metric']
+        threshold = options['threshold']
+        regressions = []
+        self.stdout.write(f'\nСравнение с {options["compare"]} ({metric}):')
+        for name, before, after, change, queries_before, queries_after in (
+            compare(baseline, report, metric)
+        ):
+            if before is None:
+                self.stdout.write(f'{name:<34} новый маршрут')
+                continue
+            line = (
+                f'{name:<34} {before:>9.2f} -> {after:>9.2f} мс '
+                f'({change:+.1f}%)  запросов {queries_before} -> '
+                f'{queries_after}'
+            )
+            regressed = threshold is not None and (
+                change > threshold or queries_after > queries_before
+            )
+            if regressed:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                'Регрессия: {}.'.format(', '.join(regressions))
+            )
@@ -0,0 +1,121 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from recipe.models import Ingredient
+
+from api.ingredient_index import invalidate_ingredient_index
+
+FORMATS = ('csv', 'json', 'ndjson')
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file, delimiter=','):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_ndjson(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            item = json.loads(line)
+            yield item['name'], item['measurement_unit']
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started:
+                if position == len(buffer):
+                    break
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив.')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON.')
+                break
+            yield item['name'], item['measurement_unit']
+        buffer = buffer[position:]
+        if not chunk:
+            if started and buffer.strip():
+                raise CommandError('Некорректный JSON.')
+            return
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'ndjson': read_ndjson}
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV, JSON или NDJSON. '
+            'Повторный запуск не создаёт дубликатов.')
+    default_path = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?' if self.default_path else None,
+            default=self.default_path
+        )
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(
+                'Не удалось определить формат, укажите --format.'
+            )
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+
+        batch_size = options['batch_size']
+        total_before = Ingredient.objects.count()
+        processed = 0
+        started = time.monotonic()
+        with path.open(encoding='utf-8') as file:
+            rows = (
+                (name.strip(), measurement_unit.strip())
+                for name, measurement_unit in READERS[file_format](file)
+            )
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                Ingredient.objects.bulk_create(
+                    [Ingredient(name=name, measurement_unit=measurement_unit)
+                     for name, measurement_unit in set(chunk) if name],
+                    ignore_conflicts=True
+                )
+                processed += len(chunk)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Обработано: {processed} '
+                    f'({processed / elapsed if elapsed else 0:.0f} строк/с)'
+                )
+        invalidate_ingredient_index()
+        created = Ingredient.objects.count() - total_before
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: обработано {processed}, добавлено {created} '
+            f'за {elapsed:.1f} с.'
+        ))
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from itertools import cycle, islice
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import PERCENTILES, percentile
+
+DEFAULT_PATHS = (
+    '/api/tags/',
+    '/api/ingredients/?name=са',
+    '/api/recipes/',
+    '/api/recipes/?page=2',
+)
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер параллельными запросами и '
+            'считает пропускную способность и перцентили задержки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=20)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--token', help='Токен для авторизации.')
+        parser.add_argument('--label', default='')
+        parser.add_argument('--output', help='Куда сохранить JSON.')
+
+    def _worker(self, paths, options, deadline, results, lock):
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        samples = []
+        for path in paths:
+            if time.monotonic() >= deadline:
+                break
+            request = Request(
+                options['base_url'] + quote(path, safe='/?=&%'),
+                headers=headers
+            )
+            started = time.perf_counter()
+            try:
+                with urlopen(request, timeout=options['timeout']) as response:
+                    response.read()
+                    status = response.status
+            except HTTPError as error:
+                status = error.code
+            except (URLError, OSError):
+                status = None
+            samples.append(
+                (path, status, (time.perf_counter() - started) * 1000)
+            )
+        with lock:
+            results.extend(samples)
+
+    def _summary(self, samples, duration):
+        timings = [elapsed for _, status, elapsed in samples
+                   if status is not None and status < 500]
+        summary = {
+            'requests': len(samples),
+            'errors': len(samples) - len(timings),
+            'rps': round(len(timings) / duration, 1),
+        }
+        for percent in PERCENTILES:
+            value = percentile(timings, percent)
+            summary[f'p{percent}_ms'] = (
+                round(value, 2) if value is not None else None
+            )
+        return summary
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('Нужен хотя бы один поток.')
+        paths = list(options['paths'])
+        results = []
+        lock = threading.Lock()
+        started = time.monotonic()
+        deadline = started + options['duration']
+        workers = [
+            threading.Thread(
+                target=self._worker,
+                args=(islice(cycle(paths), number, None),
+                      options, deadline, results, lock)
+            )
+            for number in range(options['concurrency'])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        duration = time.monotonic() - started
+
+        by_path = defaultdict(list)
+        for sample in results:
+            by_path[sample[0]].append(sample)
+        report = {
+            'meta': {
+                'label': options['label'],
+                'base_url': options['base_url'],
+                'concurrency': options['concurrency'],
+                'duration': round(duration, 2),
+            },
+            'total': self._summary(results, duration),
+            'paths': {
+                path: self._summary(samples, duration)
+                for path, samples in sorted(by_path.items())
+            },
+        }
+        for name, summary in [('всего', report['total']),
+                              *report['paths'].items()]:
+            self.stdout.write(
+                f'{name:<40} {summary["rps"]:>8.1f} запр/с  '
+                f'p50 {summary["p50_ms"]} мс  p99 {summary["p99_ms"]} мс  '
+                f'ошибок {summary["errors"]}'
+            )
+        if options['output']:
+            Path(options['output']).write_text(
+                json.dumps(report, ensure_ascii=False, indent=2)
+            )
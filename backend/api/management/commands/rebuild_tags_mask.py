@@ -0,0 +1,44 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipe.models import Recipe, tags_mask
+from recipe.versions import RECIPES_VERSION, bump_version_on_commit
+
+from api.recipe_index import invalidate_recipe_index
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает маски тегов рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        tag_ids = defaultdict(list)
+        for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+            'recipe_id', 'tag_id'
+        ).iterator():
+            tag_ids[recipe_id].append(tag_id)
+        changed = []
+        now = timezone.now()
+        for recipe in Recipe.objects.only('id', 'tags_mask').iterator():
+            mask = tags_mask(tag_ids.get(recipe.id, ()))
+            if recipe.tags_mask != mask:
+                recipe.tags_mask = mask
+                recipe.updated_at = now
+                changed.append(recipe)
+        if changed:
+            with transaction.atomic():
+                Recipe.objects.bulk_update(
+                    changed, ['tags_mask', 'updated_at'],
+                    batch_size=batch_size
+                )
+                invalidate_recipe_index()
+                bump_version_on_commit(RECIPES_VERSION)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рецептов: {len(changed)}.'
+        ))
@@ -0,0 +1,303 @@
+import random
+import time
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+from recipe.models import (
+    Cart,
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingListItem,
+    Tag,
+    tags_mask
+)
+from recipe.search import update_search_index
+from recipe.versions import RECIPES_VERSION, TAGS_VERSION, bump_version
+from users.models import User
+
+from api.ingredient_index import invalidate_ingredient_index
+from api.recipe_index import invalidate_recipe_index
+
+SEED_TAGS = (
+    ('Завтрак', 'breakfast', '#E26C2D'),
+    ('Обед', 'lunch', '#49B64E'),
+    ('Ужин', 'dinner', '#8775D2'),
+    ('Десерт', 'dessert', '#F4C430'),
+    ('Выпечка', 'bakery', '#B5651D'),
+    ('Веган', 'vegan', '#2E8B57'),
+)
+SEED_UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+SEED_WORDS = (
+    'домашний', 'быстрый', 'пряный', 'летний', 'сырный', 'овощной',
+    'запечённый', 'томлёный', 'хрустящий', 'нежный', 'острый', 'лёгкий',
+)
+SEED_DISHES = (
+    'суп', 'салат', 'пирог', 'омлет', 'рагу', 'плов', 'гратен',
+    'ризотто', 'крем-суп', 'пудинг', 'запеканка', 'боул',
+)
+SEED_IMAGE = 'recipe/seed.jpg'
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'избранным, корзинами и подписками для нагрузочных замеров.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes-per-author', type=int, default=5)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags-per-recipe', type=int, default=2)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--wide-follows', type=int, default=0,
+                            help='Создать пользователя, подписанного '
+                                 'на столько авторов.')
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Сколько ингредиентов создать, '
+                                 'если справочник пуст.')
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def _log(self, message, started):
+        self.stdout.write(f'{message} ({time.monotonic() - started:.1f} с)')
+
+    def _seed_image(self):
+        if not default_storage.exists(SEED_IMAGE):
+            buffer = BytesIO()
+            Image.new('RGB', (1200, 800), '#E8D5B7').save(buffer, 'JPEG')
+            default_storage.save(SEED_IMAGE, ContentFile(buffer.getvalue()))
+        return SEED_IMAGE
+
+    def _seed_tags(self):
+        tags = list(Tag.objects.values_list('id', flat=True))
+        if tags:
+            return tags, False
+        Tag.objects.bulk_create([
+            Tag(name=name, slug=slug, color=color)
+            for name, slug, color in SEED_TAGS
+        ])
+        return list(Tag.objects.values_list('id', flat=True)), True
+
+    def _seed_ingredients(self, rng, count, batch_size):
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        if ingredients:
+            return ingredients, False
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(
+                    name=f'{rng.choice(SEED_WORDS)} ингредиент {number}',
+                    measurement_unit=rng.choice(SEED_UNITS)
+                )
+                for number in range(count)
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+        return list(Ingredient.objects.values_list('id', flat=True)), True
+
+    def _seed_users(self, options):
+        prefix = options['prefix']
+        offset = User.objects.filter(username__startswith=prefix).count()
+        usernames = [
+            f'{prefix}{number}'
+            for number in range(offset, offset + options['users'])
+        ]
+        password = make_password(f'{prefix}-password')
+        User.objects.bulk_create(
+            [
+                User(
+                    username=username,
+                    email=f'{username}@example.com',
+                    first_name='Тест',
+                    last_name=username,
+                    password=password
+                )
+                for username in usernames
+            ],
+            batch_size=options['batch_size']
+        )
+        return list(
+            User.objects
+            .filter(username__in=usernames)
+            .values_list('id', flat=True)
+        )
+
+    def _seed_recipes(self, rng, user_ids, tag_ids, ingredient_ids, options):
+        batch_size = options['batch_size']
+        image = self._seed_image()
+        recipes = []
+        recipe_tags = []
+        for author_id in user_ids:
+            for _ in range(options['recipes_per_author']):
+                tags = rng.sample(
+                    tag_ids, min(options['tags_per_recipe'], len(tag_ids))
+                )
+                recipe_tags.append(tags)
+                recipes.append(Recipe(
+                    author_id=author_id,
+                    name=(f'{rng.choice(SEED_WORDS).capitalize()} '
+                          f'{rng.choice(SEED_DISHES)}'),
+                    text=' '.join(rng.choices(SEED_WORDS, k=30)),
+                    cooking_time=rng.randint(5, 180),
+                    image=image,
+                    tags_mask=tags_mask(tags)
+                ))
+        Recipe.objects.bulk_create(recipes, batch_size=batch_size)
+        recipe_ids = list(
+            Recipe.objects
+            .filter(author_id__in=user_ids)
+            .order_by('author_id', 'id')
+            .values_list('id', flat=True)
+        )
+
+        Through = Recipe.tags.through
+        Through.objects.bulk_create(
+            [
+                Through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id, tags in zip(recipe_ids, recipe_tags)
+                for tag_id in tags
+            ],
+            batch_size=batch_size
+        )
+        per_recipe = min(options['ingredients_per_recipe'],
+                         len(ingredient_ids))
+        IngredientRecipe.objects.bulk_create(
+            [
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.randint(1, 500)
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(ingredient_ids, per_recipe)
+            ],
+            batch_size=batch_size
+        )
+        return recipe_ids
+
+    def _seed_relations(self, model, rng, user_ids, recipe_ids, per_user,
+                        batch_size):
+        per_user = min(per_user, len(recipe_ids))
+        model.objects.bulk_create(
+            [
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in rng.sample(recipe_ids, per_user)
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+
+    def _seed_follows(self, rng, user_ids, per_user, batch_size):
+        per_user = min(per_user, len(user_ids) - 1)
+        follows = []
+        for user_id in user_ids:
+            authors = [
+                author_id
+                for author_id in rng.sample(user_ids, per_user + 1)
+                if author_id != user_id
+            ]
+            follows.extend(
+                Follow(user_id=user_id, author_id=author_id)
+                for author_id in authors[:per_user]
+            )
+        Follow.objects.bulk_create(
+            follows,
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+
+    def _seed_wide_follower(self, rng, user_ids, count, options):
+        username = f'{options["prefix"]}_wide{user_ids[0]}'
+        follower = User.objects.create(
+            username=username,
+            email=f'{username}@example.com',
+            first_name='Тест',
+            last_name=username,
+            password=make_password(f'{options["prefix"]}-password')
+        )
+        Follow.objects.bulk_create(
+            [
+                Follow(user=follower, author_id=author_id)
+                for author_id in rng.sample(
+                    user_ids, min(count, len(user_ids))
+                )
+            ],
+            batch_size=options['batch_size']
+        )
+        return follower
+
+    def _seed_shopping_lists(self, user_ids, batch_size):
+        ShoppingListItem.objects.bulk_create(
+            [
+                ShoppingListItem(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=total
+                )
+                for user_id, ingredient_id, total in (
+                    ShoppingListItem.objects.live_totals(user_ids).iterator()
+                )
+            ],
+            batch_size=batch_size
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        with transaction.atomic():
+            tag_ids, tags_created = self._seed_tags()
+            ingredient_ids, ingredients_created = self._seed_ingredients(
+                rng, options['ingredients'], batch_size
+            )
+            self._log(f'Теги: {len(tag_ids)}, ингредиенты: '
+                      f'{len(ingredient_ids)}', started)
+            user_ids = self._seed_users(options)
+            self._log(f'Пользователи: {len(user_ids)}', started)
+            recipe_ids = self._seed_recipes(
+                rng, user_ids, tag_ids, ingredient_ids, options
+            )
+            self._log(f'Рецепты: {len(recipe_ids)}', started)
+            self._seed_relations(Favorite, rng, user_ids, recipe_ids,
+                                 options['favorites_per_user'], batch_size)
+            self._seed_relations(Cart, rng, user_ids, recipe_ids,
+                                 options['carts_per_user'], batch_size)
+            self._seed_follows(rng, user_ids, options['follows_per_user'],
+                               batch_size)
+            if options['wide_follows'] > 0:
+                follower = self._seed_wide_follower(
+                    rng, user_ids, options['wide_follows'], options
+                )
+                self._log(f'Подписчик {follower.email}: '
+                          f'{follower.follower.count()} подписок', started)
+            self._seed_shopping_lists(user_ids, batch_size)
+            if recipe_ids:
+                Recipe.objects.filter(
+                    id__gte=min(recipe_ids)
+                ).sync_counters(batch_size=batch_size)
+            update_search_index(recipe_ids, batch_size=batch_size)
+            invalidate_recipe_index()
+            self._log('Избранное, корзины и подписки', started)
+            if ingredients_created:
+                invalidate_ingredient_index()
+        bump_version(RECIPES_VERSION)
+        if tags_created:
+            bump_version(TAGS_VERSION)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: пользователей {len(user_ids)}, '
+            f'рецептов {len(recipe_ids)} '
+            f'за {time.monotonic() - started:.1f} с.'
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает списки покупок по корзинам или проверяет '
+            'их расхождение с корзинами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить, не изменяя данные.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = ShoppingListItem.objects.diff_with_live()
+            for (user_id, ingredient_id), delta in sorted(drift.items()):
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id} '
+                    f'delta={delta:+d}'
+                )
+            if drift:
+                raise CommandError(f'Расхождений: {len(drift)}.')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        ShoppingListItem.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в списках покупок: {ShoppingListItem.objects.count()}.'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счётчики избранного и корзин у рецептов с фактическими '
+            'записями и исправляет расхождения пачками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить, не изменяя данные.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drift = Recipe.objects.sync_counters(
+            batch_size=options['batch_size'],
+            dry_run=options['check']
+        )
+        for recipe_id, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(
+                f'recipe={recipe_id} stored={stored} actual={actual}'
+            )
+        if options['check']:
+            if drift:
+                raise CommandError(f'Расхождений: {len(drift)}.')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено рецептов: {len(drift)}.'
+        ))
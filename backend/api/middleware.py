@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from recipe.versions import read_snapshot, versions_snapshot
+
+from api.profiling import RequestProfile, current_profile
+
+logger = logging.getLogger('api.performance')
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        request.profile = profile
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self._finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        request.profile = profile
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self._finish(request, response, profile)
+
+    def _finish(self, request, response, profile):
+        finished = time.perf_counter()
+        timings = self._timings(profile, finished)
+        if settings.SERVER_TIMING:
+            metrics = [
+                f'{name};dur={duration:.1f}'
+                for name, duration in timings.items()
+            ]
+            metrics.append(f'queries;desc="{profile.queries}"')
+            response['Server-Timing'] = ', '.join(metrics)
+        self._log(request, response, profile, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = request.profile
+        profile.view_name = (
+            request.resolver_match.view_name if request.resolver_match
+            else view_func.__name__
+        )
+        profile.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        request.profile.view_finished = time.perf_counter()
+        return response
+
+    def _timings(self, profile, finished):
+        timings = {
+            'total': finished - profile.started,
+            'db': profile.db_time,
+        }
+        if profile.view_started is not None:
+            view_finished = profile.view_finished or finished
+            timings['view'] = view_finished - profile.view_started
+            timings['serialize'] = profile.serialization_time
+            timings['render'] = finished - view_finished
+        return {name: value * 1000 for name, value in timings.items()}
+
+    def _response_size(self, response):
+        if response.has_header('Content-Length'):
+            return int(response['Content-Length'])
+        if response.streaming:
+            return None
+        return len(response.content)
+
+    def _log(self, request, response, profile, timings):
+        repeated = profile.repeated(settings.SLOW_REQUEST_REPEATED_QUERIES)
+        if (timings['total'] < settings.SLOW_REQUEST_MS
+                and profile.queries < settings.SLOW_REQUEST_QUERIES
+                and not repeated):
+            return
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': profile.view_name,
+            'status': response.status_code,
+            'queries': profile.queries,
+            'response_bytes': self._response_size(response),
+            'repeated_queries': repeated,
+        }
+        record.update(
+            (f'{name}_ms', round(duration, 1))
+            for name, duration in timings.items()
+        )
+        logger.warning(
+            'Запрос превысил пороги: %s',
+            json.dumps(record, ensure_ascii=False)
+        )
+
+
+class VersionSnapshotMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with versions_snapshot(read_snapshot()):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        snapshot = await sync_to_async(read_snapshot)()
+        with versions_snapshot(snapshot):
+            return await self.get_response(request)
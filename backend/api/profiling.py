@@ -0,0 +1,83 @@
+import sys
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from rest_framework import serializers
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def query_origin():
+    origin = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if (isinstance(owner, serializers.Field)
+                and owner.field_name and owner.parent is not None):
+            field = f'{type(owner.parent).__name__}.{owner.field_name}'
+            if not isinstance(owner, serializers.BaseSerializer):
+                return field
+            origin = origin or field
+        frame = frame.f_back
+    return origin
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_name = None
+        self.view_started = None
+        self.view_finished = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.statements = Counter()
+        self.origins = {}
+        self._serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+            if self.statements[sql] == 2:
+                self.origins[sql] = query_origin()
+
+    def repeated(self, threshold):
+        return [
+            {
+                'sql': sql[:300],
+                'count': count,
+                'view': self.view_name,
+                'field': self.origins.get(sql),
+            }
+            for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+def profile_queries(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+class ProfiledSerializerMixin:
+
+    def to_representation(self, instance):
+        profile = current_profile.get()
+        if profile is None or profile._serializing:
+            return super().to_representation(instance)
+        profile._serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.serialization_time += time.perf_counter() - started
+            profile._serializing = False
@@ -0,0 +1,239 @@
+import heapq
+import threading
+from array import array
+from collections import Counter, defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from recipe.models import IngredientRecipe, Recipe
+from recipe.versions import bump_version_on_commit, get_version
+
+RECIPE_INDEX_VERSION = 'recipe_index_version'
+RECIPE_INDEX_SYNC_VERSION = 'recipe_index_sync_version'
+INGREDIENTS_WEIGHT = 0.8
+TAGS_WEIGHT = 0.2
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+def _jaccard(common, left, right):
+    union = left + right - common
+    return common / union if union else 0.0
+
+
+IndexState = namedtuple('IndexState', (
+    'version', 'sync_version', 'synced_at', 'positions', 'ids', 'masks',
+    'updated', 'ingredients', 'postings'
+))
+
+EMPTY_STATE = IndexState(
+    None, None, None, {}, array('q'), array('q'), array('d'), [], {}
+)
+
+
+class RecipeIngredientIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = EMPTY_STATE
+
+    def _read(self, recipes):
+        rows = list(recipes.values_list('id', 'tags_mask', 'updated_at'))
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in (
+            IngredientRecipe.objects
+            .filter(recipe__in=recipes)
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator()
+        ):
+            ingredients[recipe_id].append(ingredient_id)
+        return rows, ingredients
+
+    def _build(self, version, sync_version):
+        rows, ingredients = self._read(Recipe.objects.all())
+        positions = {}
+        ids = array('q')
+        masks = array('q')
+        updated = array('d')
+        vectors = []
+        postings = defaultdict(list)
+        for position, (recipe_id, mask, updated_at) in enumerate(rows):
+            positions[recipe_id] = position
+            ids.append(recipe_id)
+            masks.append(mask)
+            updated.append(updated_at.timestamp())
+            vector = array('l', sorted(set(ingredients[recipe_id])))
+            vectors.append(vector)
+            for ingredient_id in vector:
+                postings[ingredient_id].append(position)
+        return IndexState(
+            version=version,
+            sync_version=sync_version,
+            synced_at=max((row[2] for row in rows), default=None),
+            positions=positions,
+            ids=ids,
+            masks=masks,
+            updated=updated,
+            ingredients=vectors,
+            postings={
+                ingredient_id: array('l', items)
+                for ingredient_id, items in postings.items()
+            }
+        )
+
+    def _sync(self, state, sync_version):
+        recipes = Recipe.objects.all()
+        if state.synced_at is not None:
+            recipes = recipes.filter(
+                updated_at__gte=state.synced_at - SYNC_OVERLAP
+            )
+        rows, ingredients = self._read(recipes)
+        positions = dict(state.positions)
+        ids = array('q', state.ids)
+        masks = array('q', state.masks)
+        updated = array('d', state.updated)
+        vectors = list(state.ingredients)
+        postings = dict(state.postings)
+        synced_at = state.synced_at
+        for recipe_id, mask, updated_at in rows:
+            vector = array('l', sorted(set(ingredients[recipe_id])))
+            position = positions.get(recipe_id)
+            if position is None:
+                position = len(ids)
+                ids.append(recipe_id)
+                masks.append(mask)
+                updated.append(0.0)
+                vectors.append(array('l'))
+                positions[recipe_id] = position
+            old = vectors[position]
+            for ingredient_id in set(old) - set(vector):
+                postings[ingredient_id] = array('l', (
+                    item for item in postings[ingredient_id]
+                    if item != position
+                ))
+            for ingredient_id in set(vector) - set(old):
+                postings[ingredient_id] = (
+                    postings.get(ingredient_id, array('l'))
+                    + array('l', (position,))
+                )
+            masks[position] = mask
+            updated[position] = updated_at.timestamp()
+            vectors[position] = vector
+            if synced_at is None or updated_at > synced_at:
+                synced_at = updated_at
+        return state._replace(
+            sync_version=sync_version,
+            synced_at=synced_at,
+            positions=positions,
+            ids=ids,
+            masks=masks,
+            updated=updated,
+            ingredients=vectors,
+            postings=postings
+        )
+
+    def _ensure_fresh(self):
+        version = get_version(RECIPE_INDEX_VERSION)
+        sync_version = get_version(RECIPE_INDEX_SYNC_VERSION)
+        state = self._state
+        if state.version == version and state.sync_version == sync_version:
+            return state
+        with self._lock:
+            state = self._state
+            if state.version != version:
+                state = self._build(version, sync_version)
+            elif state.sync_version != sync_version:
+                state = self._sync(state, sync_version)
+            self._state = state
+        return state
+
+    def _score(self, state, position, limit):
+        vector = state.ingredients[position]
+        mask = state.masks[position]
+        tags = mask.bit_count()
+        shared = Counter()
+        for ingredient_id in vector:
+            shared.update(state.postings.get(ingredient_id, ()))
+        shared.pop(position, None)
+        scored = []
+        for other, common in shared.items():
+            other_mask = state.masks[other]
+            score = (
+                INGREDIENTS_WEIGHT * _jaccard(
+                    common, len(vector), len(state.ingredients[other])
+                )
+                + TAGS_WEIGHT * _jaccard(
+                    (mask & other_mask).bit_count(),
+                    tags,
+                    other_mask.bit_count()
+                )
+            )
+            scored.append((score, state.ids[other]))
+        return [
+            recipe_id for _, recipe_id in heapq.nlargest(limit, scored)
+        ]
+
+    def similar(self, recipe_id, limit=None):
+        if limit is None:
+            limit = settings.SIMILAR_RECIPES_LIMIT
+        state = self._ensure_fresh()
+        position = state.positions.get(recipe_id)
+        if position is None:
+            return None
+        key = 'similar:{}:{}:{}:{}:{}'.format(
+            recipe_id,
+            state.version,
+            state.sync_version,
+            state.updated[position],
+            settings.SIMILAR_RECIPES_MAX
+        )
+        similar = cache.get(key)
+        if similar is None:
+            similar = self._score(
+                state, position, settings.SIMILAR_RECIPES_MAX
+            )
+            cache.set(
+                key, similar, timeout=settings.SIMILAR_RECIPES_CACHE_TIMEOUT
+            )
+        return similar[:limit]
+
+    def match_pantry(self, ingredient_ids, max_missing=0):
+        state = self._ensure_fresh()
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(state.postings.get(ingredient_id, ()))
+        ingredients = state.ingredients
+        ids = state.ids
+        ranked = [
+            (missing, -count, -ids[position])
+            for position, count in matched.items()
+            for missing in (len(ingredients[position]) - count,)
+            if missing <= max_missing
+        ]
+        ranked.sort()
+        return [-recipe_id for *_, recipe_id in ranked]
+
+    def missing_ingredients(self, recipe_ids, ingredient_ids):
+        state = self._state
+        pantry = set(ingredient_ids)
+        missing = {}
+        for recipe_id in recipe_ids:
+            position = state.positions.get(recipe_id)
+            if position is not None:
+                missing[recipe_id] = [
+                    ingredient_id
+                    for ingredient_id in state.ingredients[position]
+                    if ingredient_id not in pantry
+                ]
+        return missing
+
+
+def invalidate_recipe_index():
+    bump_version_on_commit(RECIPE_INDEX_SYNC_VERSION)
+
+
+def rebuild_recipe_index():
+    bump_version_on_commit(RECIPE_INDEX_VERSION)
+
+
+recipe_index = RecipeIngredientIndex()
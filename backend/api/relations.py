@@ -0,0 +1,63 @@
+from array import array
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from recipe.models import Cart, Favorite, Follow
+from recipe.versions import get_version, user_relations_version
+
+UserRelations = namedtuple(
+    'UserRelations', ('favorites', 'carts', 'follows')
+)
+
+EMPTY_RELATIONS = UserRelations(frozenset(), frozenset(), frozenset())
+
+
+def _relations_key(user_id):
+    return 'user_relations:{}:{}'.format(
+        user_id, get_version(user_relations_version(user_id))
+    )
+
+
+def _load_relations(user_id):
+    return (
+        array('q', Favorite.objects.filter(user_id=user_id)
+              .values_list('recipe_id', flat=True)),
+        array('q', Cart.objects.filter(user_id=user_id)
+              .values_list('recipe_id', flat=True)),
+        array('q', Follow.objects.filter(user_id=user_id)
+              .values_list('author_id', flat=True)),
+    )
+
+
+def refresh_relations(user_id):
+    stored = _load_relations(user_id)
+    if settings.CACHE_SHARED:
+        cache.set(
+            _relations_key(user_id),
+            stored,
+            timeout=settings.USER_RELATIONS_CACHE_TIMEOUT
+        )
+    return stored
+
+
+def refresh_relations_on_commit(user_id):
+    if settings.CACHE_SHARED:
+        transaction.on_commit(lambda: refresh_relations(user_id))
+
+
+def get_relations(request):
+    user = request.user
+    if not user.is_authenticated:
+        return EMPTY_RELATIONS
+    relations = getattr(request, '_relations', None)
+    if relations is None:
+        stored = None
+        if settings.CACHE_SHARED:
+            stored = cache.get(_relations_key(user.id))
+        if stored is None:
+            stored = refresh_relations(user.id)
+        relations = UserRelations(*map(frozenset, stored))
+        request._relations = relations
+    return relations
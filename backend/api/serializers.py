@@ -1,19 +1,29 @@
+from django.conf import settings
 from django.core.validators import MaxValueValidator
+from django.db import transaction
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
+from recipe.images import process_recipe_image
 from recipe.models import (
     Cart,
     Favorite,
     Ingredient,
     IngredientRecipe,
     Recipe,
+    ShoppingListItem,
     Tag,
-    User
+    User,
+    tags_mask
 )
 from rest_framework import serializers
 
+from api.fields import Base64ImageUploadField, ImageVariantsField
+from api.profiling import ProfiledSerializerMixin
+from api.recipe_index import invalidate_recipe_index
+from api.relations import get_relations
 
-class TagSerializer(serializers.ModelSerializer):
+
+class TagSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Tag
@@ -21,14 +31,15 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(ProfiledSerializerMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(ProfiledSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -39,8 +50,9 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user_id = self.context.get('request').user.id
-        return obj.following.filter(id=user_id).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_relations(self.context['request']).follows
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -69,7 +81,7 @@ class IngredientinRecipeCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     author = CustomUserSerializer()
     tags = TagSerializer(many=True)
     ingredients = IngredientRecipeSerializer(
@@ -82,32 +94,34 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField(
         read_only=True
     )
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'images', 'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        return (request.user.is_authenticated
-                and request.user.favorite_user.filter(recipe=obj).exists())
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.id in get_relations(self.context['request']).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        return (request.user.is_authenticated
-                and request.user.cart_user.filter(recipe=obj).exists())
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.id in get_relations(self.context['request']).carts
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeCreateSerializer(ProfiledSerializerMixin,
+                             serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True
     )
     ingredients = IngredientinRecipeCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = Base64ImageUploadField()
     cooking_time = serializers.IntegerField(
         validators=[MaxValueValidator(1000)],
         min_value=0,
@@ -148,29 +162,67 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 'Ингредиенты должны быть уникальными.'
             )
 
+        missing = set(ingredient_id) - set(
+            Ingredient.objects.in_bulk(ingredient_id)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}.'.format(
+                    ', '.join(map(str, sorted(missing)))
+                )
+            )
+
         return validated_data
 
+    def _write_ingredients(self, recipe, ingredients_data, existing=()):
+        existing = {row.ingredient_id: row for row in existing}
+        amounts = {
+            ingredient_data['id']: ingredient_data['amount']
+            for ingredient_data in ingredients_data
+        }
+        to_create = [
+            IngredientRecipe(recipe=recipe,
+                             ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        to_update = []
+        for ingredient_id, row in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                to_update.append(row)
+        to_delete = [row.id for ingredient_id, row in existing.items()
+                     if ingredient_id not in amounts]
+
+        if to_delete:
+            IngredientRecipe.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientRecipe.objects.bulk_create(to_create)
+        if to_delete or to_update or to_create:
+            invalidate_recipe_index()
+        return amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         tags_data = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
-
-        for tag in tags_data:
-            recipe.tags.add(tag)
-
-        for ingredient_data in ingredients_data:
-            ingredient_id = ingredient_data.get('id')
-            amount = ingredient_data.get('amount')
-
-            if ingredient_id is not None:
-                ingredient_obj = Ingredient.objects.get(pk=ingredient_id)
-                IngredientRecipe.objects.create(recipe=recipe,
-                                                ingredient=ingredient_obj,
-                                                amount=amount)
-        recipe.save()
+        recipe = Recipe.objects.create(
+            tags_mask=tags_mask(tag.id for tag in tags_data),
+            **validated_data
+        )
+        recipe.tags.set(tags_data)
+        self._write_ingredients(recipe, ingredients_data)
+        process_recipe_image(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        Recipe.objects.filter(id=instance.id).lock()
+        update_fields = ['name', 'text', 'cooking_time', 'updated_at']
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get('cooking_time',
@@ -178,36 +230,42 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         image = validated_data.get('image')
         if image:
             instance.image = image
+            instance.image_variants = {}
+            update_fields += ['image', 'image_variants']
         tags_data = validated_data.get('tags')
         if tags_data:
             instance.tags.set(tags_data)
+            instance.tags_mask = tags_mask(tag.id for tag in tags_data)
+            update_fields.append('tags_mask')
 
         ingredients_data = validated_data.get('ingredients')
 
         if ingredients_data:
-            IngredientRecipe.objects.filter(recipe=instance).delete()
-            for ingredient_data in ingredients_data:
-                ingredient_id = ingredient_data.get('id')
-                amount = ingredient_data.get('amount')
-                if ingredient_id is not None:
-                    ingredient_obj = Ingredient.objects.get(pk=ingredient_id)
-                    IngredientRecipe.objects.create(recipe=instance,
-                                                    ingredient=ingredient_obj,
-                                                    amount=amount)
-        instance.save()
+            existing = list(instance.ingredientrecipe.all())
+            old_amounts = {row.ingredient_id: row.amount for row in existing}
+            new_amounts = self._write_ingredients(
+                instance, ingredients_data, existing
+            )
+            ShoppingListItem.objects.change_recipe(
+                instance, old_amounts, new_amounts
+            )
+        instance.save(update_fields=update_fields)
+        if image:
+            process_recipe_image(instance)
         return instance
 
 
 class FollowListSerializer(serializers.ModelSerializer):
 
     image = Base64ImageField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -236,27 +294,55 @@ class FollowSerializer(serializers.ModelSerializer):
         return data
 
     def get_is_subscribed(self, obj):
-        request = self.context['request']
-        if request.user.is_authenticated:
-            return request.user.follower.filter(author=obj).exists()
-        return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_relations(self.context['request']).follows
 
     def get_recipes(self, obj):
-        return FollowListSerializer(obj.recipes.all(), many=True).data
+        if hasattr(obj, 'recipes_list'):
+            recipes = obj.recipes_list
+        else:
+            recipes = obj.recipes.all()
+        return FollowListSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Favorite
         fields = ('user', 'recipe')
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Cart
         fields = ('user', 'recipe')
+
+
+class RelationIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RELATIONS_LIMIT
+    )
+
+    def validate_ids(self, value):
+        value = list(dict.fromkeys(value))
+        targets = self.context.get('targets')
+        if targets is None:
+            return value
+        found = set(
+            targets.filter(id__in=value).values_list('id', flat=True)
+        )
+        missing = [target_id for target_id in value if target_id not in found]
+        if missing:
+            raise serializers.ValidationError(
+                'Не найдены: {}.'.format(', '.join(map(str, missing)))
+            )
+        return value
@@ -0,0 +1,53 @@
+import csv
+import json
+
+from rest_framework.negotiation import DefaultContentNegotiation
+
+SHOPPING_LIST_FILENAME = 'shopping_list'
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+def render_txt(rows):
+    for name, amount, measurement_unit in rows:
+        yield '{} - {} {}\n'.format(name, amount, measurement_unit)
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_json(rows):
+    separator = ''
+    yield '['
+    for name, amount, measurement_unit in rows:
+        yield separator + json.dumps(
+            {
+                'name': name,
+                'amount': amount,
+                'measurement_unit': measurement_unit
+            },
+            ensure_ascii=False
+        )
+        separator = ', '
+    yield ']\n'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json', render_json),
+}
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
@@ -0,0 +1,204 @@
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from recipe.models import (
+    Cart,
+    Favorite,
+    FeedItem,
+    Follow,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingListItem,
+    Tag,
+    tags_mask
+)
+from recipe.search import create_search_index, update_search_index_on_commit
+from recipe.versions import (
+    RECIPES_VERSION,
+    TAGS_VERSION,
+    bump_version_on_commit,
+    user_relations_version
+)
+
+from api.authentication import (
+    CREDENTIAL_FIELDS,
+    invalidate_token_cache,
+    invalidate_user_tokens
+)
+from api.ingredient_index import invalidate_ingredient_index
+from api.profiling import profile_queries
+from api.recipe_index import invalidate_recipe_index, rebuild_recipe_index
+from users.models import User
+
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, instance, signal, **kwargs):
+    invalidate_ingredient_index()
+    if signal is post_save:
+        recipes = Recipe.objects.filter(ingredients=instance)
+        update_search_index_on_commit(recipes.values_list('id', flat=True))
+        recipes.touch()
+    bump_version_on_commit(RECIPES_VERSION)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    recipe_ids = list(
+        Recipe.objects
+        .filter(ingredients=instance)
+        .values_list('id', flat=True)
+    )
+    update_search_index_on_commit(recipe_ids)
+    Recipe.objects.filter(id__in=recipe_ids).touch()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    if profile_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_queries)
+
+
+@receiver(post_migrate)
+def search_index_migrated(sender, using, **kwargs):
+    if sender.name == 'recipe':
+        create_search_index(using)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    ShoppingListItem.objects.delete_recipe(instance)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipes_changed(sender, instance, signal, created=False, **kwargs):
+    update_search_index_on_commit((instance.id,))
+    if created:
+        FeedItem.objects.fan_out(instance)
+        invalidate_recipe_index()
+    if signal is post_delete:
+        rebuild_recipe_index()
+    bump_version_on_commit(RECIPES_VERSION)
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def recipe_ingredients_changed(sender, instance, origin=None, **kwargs):
+    cascade = (Recipe, Ingredient)
+    if not (isinstance(origin, cascade)
+            or getattr(origin, 'model', None) in cascade):
+        update_search_index_on_commit((instance.recipe_id,))
+        Recipe.objects.filter(id=instance.recipe_id).touch()
+    invalidate_recipe_index()
+    bump_version_on_commit(RECIPES_VERSION)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(id=instance.id)
+        mask = tags_mask(pk_set or ())
+    else:
+        if action == 'pre_clear':
+            recipes = Recipe.objects.filter(tags=instance)
+        else:
+            recipes = Recipe.objects.filter(id__in=pk_set)
+        mask = tags_mask((instance.id,))
+    if action == 'post_add':
+        recipes.touch(tags_mask=F('tags_mask').bitor(mask))
+    elif reverse or action == 'post_remove':
+        recipes.touch(tags_mask=F('tags_mask').bitand(~mask))
+    else:
+        recipes.touch(tags_mask=0)
+    invalidate_recipe_index()
+    bump_version_on_commit(RECIPES_VERSION)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    Recipe.objects.filter(tags=instance).touch(
+        tags_mask=F('tags_mask').bitand(~tags_mask((instance.id,)))
+    )
+    invalidate_recipe_index()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, instance, signal, **kwargs):
+    if signal is post_save:
+        Recipe.objects.filter(tags=instance).touch()
+    bump_version_on_commit(RECIPES_VERSION)
+    bump_version_on_commit(TAGS_VERSION)
+
+
+@receiver(pre_save, sender=User)
+def author_changing(sender, instance, update_fields=None, **kwargs):
+    fields = set(AUTHOR_FIELDS)
+    if update_fields is not None:
+        fields &= set(update_fields)
+    instance._author_changed = False
+    if instance.pk is None or not fields:
+        return
+    stored = User.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._author_changed = stored is not None and any(
+        stored[field] != getattr(instance, field) for field in fields
+    )
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, **kwargs):
+    if created or not getattr(instance, '_author_changed', False):
+        return
+    instance._author_changed = False
+    if Recipe.objects.filter(author=instance).touch():
+        bump_version_on_commit(RECIPES_VERSION)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+def user_relations_changed(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        bump_version_on_commit(user_relations_version(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+def recipe_counters_changed(sender, instance, signal, created=False,
+                            **kwargs):
+    if signal is post_save and not created:
+        return
+    if instance.recipe_id is not None:
+        sender.objects.change_counters(
+            (instance.recipe_id,), 1 if signal is post_save else -1
+        )
+
+
+@receiver(pre_save, sender=User)
+def user_credentials_changed(sender, instance, update_fields=None, **kwargs):
+    fields = set(CREDENTIAL_FIELDS)
+    if update_fields is not None:
+        fields &= set(update_fields)
+    if instance.pk is None or not fields:
+        return
+    stored = User.objects.filter(pk=instance.pk).values(*fields).first()
+    if stored is not None and any(
+        stored[field] != getattr(instance, field) for field in fields
+    ):
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token_cache((instance.key,))
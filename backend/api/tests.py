@@ -0,0 +1,1030 @@
+import tempfile
+import threading
+from base64 import b64decode
+from collections import Counter
+from io import StringIO
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from recipe.models import (
+    Cart,
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingListItem,
+    Tag,
+    tags_mask
+)
+from recipe.search import update_search_index
+from recipe.versions import RECIPES_VERSION, bump_version, get_version
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_auth_version, token_cache
+from api.recipe_index import (
+    SYNC_OVERLAP,
+    invalidate_recipe_index,
+    recipe_index
+)
+from api.serializers import RecipeCreateSerializer
+from users.models import User
+
+RECIPES_COUNT = 150
+PAGE_SIZES = (6, 50)
+CONCURRENT_REQUESTS = 8
+EDIT_ROUNDS = 10
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        first_name='Тест',
+        last_name=username,
+        password='test-password'
+    )
+
+
+def create_recipes(authors, tags, ingredients, count, ingredients_per_recipe,
+                   prefix='Рецепт'):
+    Recipe.objects.bulk_create([
+        Recipe(
+            author=authors[number % len(authors)],
+            name=f'{prefix} {number}',
+            text='Описание',
+            cooking_time=10,
+            image='recipe/test.jpg',
+            tags_mask=tags_mask(tag.id for tag in tags)
+        )
+        for number in range(count)
+    ])
+    recipes = list(
+        Recipe.objects.filter(name__startswith=f'{prefix} ').order_by('id')
+    )
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe=recipe, tag=tag)
+        for recipe in recipes
+        for tag in tags
+    ])
+    IngredientRecipe.objects.bulk_create([
+        IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=5)
+        for recipe in recipes
+        for ingredient in ingredients[:ingredients_per_recipe]
+    ])
+    return recipes
+
+
+class RecipeQueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = [create_user(f'author{number}') for number in range(3)]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(20)
+        ]
+        cls.recipes = create_recipes(
+            cls.authors, cls.tags, cls.ingredients, RECIPES_COUNT, 8
+        )
+        cls.small_recipe, = create_recipes(
+            cls.authors[:1], cls.tags[:1], cls.ingredients, 1, 1,
+            prefix='Простой рецепт'
+        )
+        Favorite.objects.bulk_create([
+            Favorite(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::2]
+        ])
+        Follow.objects.create(user=cls.user, author=cls.authors[0])
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.authenticated = APIClient()
+        self.authenticated.force_authenticate(self.user)
+
+    def count_queries(self, client, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def assert_constant_for_page_sizes(self, client, url):
+        expected, response = self.count_queries(
+            client, f'{url}limit={PAGE_SIZES[0]}'
+        )
+        self.assertEqual(len(response.data['results']), PAGE_SIZES[0])
+        for page_size in PAGE_SIZES[1:]:
+            cache.clear()
+            with self.assertNumQueries(expected):
+                response = client.get(f'{url}limit={page_size}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_list(self):
+        for name, client in (('anonymous', self.anonymous),
+                             ('authenticated', self.authenticated)):
+            with self.subTest(client=name):
+                self.assert_constant_for_page_sizes(client, '/api/recipes/?')
+
+    def test_filtered_list(self):
+        url = '/api/recipes/?tags={}&tags={}&author={}&'.format(
+            self.tags[0].slug, self.tags[1].slug, self.authors[0].id
+        )
+        for name, client in (('anonymous', self.anonymous),
+                             ('authenticated', self.authenticated)):
+            with self.subTest(client=name):
+                self.assert_constant_for_page_sizes(client, url)
+        for filters in ('is_favorited=1&', 'is_in_shopping_cart=1&'):
+            with self.subTest(filters=filters):
+                self.assert_constant_for_page_sizes(
+                    self.authenticated, f'/api/recipes/?{filters}'
+                )
+
+    def test_detail(self):
+        for name, client in (('anonymous', self.anonymous),
+                             ('authenticated', self.authenticated)):
+            with self.subTest(client=name):
+                expected, response = self.count_queries(
+                    client, f'/api/recipes/{self.small_recipe.id}/'
+                )
+                self.assertEqual(len(response.data['ingredients']), 1)
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = client.get(
+                        f'/api/recipes/{self.recipes[0].id}/'
+                    )
+                self.assertEqual(len(response.data['ingredients']), 8)
+                self.assertEqual(len(response.data['tags']), 3)
+
+
+class RecipeIngredientChangesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        cls.recipe, = create_recipes([cls.author], [], cls.ingredients, 1, 3)
+        cls.url = f'/api/recipes/{cls.recipe.id}/'
+
+    def setUp(self):
+        cache.clear()
+
+    def served_ingredients(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            (ingredient['id'], ingredient['amount'])
+            for ingredient in response.data['ingredients']
+        ]
+
+    def test_ingredient_delete(self):
+        first, second, third = self.ingredients
+        self.assertCountEqual(
+            self.served_ingredients(),
+            [(first.id, 5), (second.id, 5), (third.id, 5)]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertCountEqual(
+            self.served_ingredients(), [(second.id, 5), (third.id, 5)]
+        )
+
+    def test_ingredient_row_edit(self):
+        self.served_ingredients()
+        row = IngredientRecipe.objects.get(
+            recipe=self.recipe, ingredient=self.ingredients[0]
+        )
+        row.amount = 7
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        self.assertIn((self.ingredients[0].id, 7), self.served_ingredients())
+
+    def test_etag_changes_on_ingredient_delete(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code,
+            304
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredients[0].delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['ingredients']), 2)
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.recipes = create_recipes([author], [], [], 40, 0)
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in cls.recipes[:10]]
+        ).update(favorites_count=3)
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('OFFSET', queries[0]['sql'])
+            page = [recipe['id'] for recipe in response.data['results']]
+            ids = ids + page if link == 'next' else page + ids
+            url = response.data[link]
+            if url:
+                cursor = parse_qs(urlparse(url).query)['cursor'][0]
+                self.assertNotIn('o', parse_qs(b64decode(cursor).decode()))
+        return ids
+
+    def test_popular_ties(self):
+        expected = list(
+            Recipe.objects.popular().values_list('id', flat=True)
+        )
+        ids = self.walk('/api/recipes/?ordering=popular&cursor=&limit=7',
+                        'next')
+        self.assertEqual(ids, expected)
+        last_page = self.client.get(
+            '/api/recipes/?ordering=popular&cursor=&limit=7'
+        )
+        while last_page.data['next']:
+            last_page = self.client.get(last_page.data['next'])
+        backwards = self.walk(last_page.data['previous'], 'previous')
+        self.assertEqual(
+            backwards + [recipe['id'] for recipe in last_page.data['results']],
+            expected
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=cD01')
+        self.assertEqual(response.status_code, 404)
+
+
+class SimilarRecipesCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        cls.recipes = create_recipes(
+            [cls.author], [cls.tag], cls.ingredients, 3, 2
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unrelated_writes_keep_versions(self):
+        recipe = self.recipes[0]
+        similar = recipe_index.similar(recipe.id)
+        state = recipe_index._ensure_fresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Новое имя'
+            self.author.save()
+            self.tag.name = 'Новый тег'
+            self.tag.save()
+            Recipe.objects.get(id=recipe.id).save()
+        self.assertIs(recipe_index._ensure_fresh(), state)
+        self.assertEqual(recipe_index.similar(recipe.id), similar)
+
+    def test_ingredient_change_refreshes(self):
+        first, second, third = self.recipes
+        self.assertEqual(
+            recipe_index.similar(first.id), [third.id, second.id]
+        )
+        state = recipe_index._ensure_fresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.filter(recipe=second).delete()
+            IngredientRecipe.objects.create(
+                recipe=second, ingredient=self.ingredients[3], amount=1
+            )
+        fresh = recipe_index._ensure_fresh()
+        self.assertEqual(fresh.version, state.version)
+        self.assertNotEqual(fresh.sync_version, state.sync_version)
+        self.assertEqual(
+            recipe_index._score(state, state.positions[first.id], 2),
+            [third.id, second.id]
+        )
+        self.assertEqual(recipe_index.similar(first.id), [third.id])
+
+    def test_edit_outside_sync_overlap(self):
+        first, second, third = self.recipes
+        Recipe.objects.exclude(id=first.id).update(
+            updated_at=timezone.now() - SYNC_OVERLAP * 60
+        )
+        self.assertEqual(
+            recipe_index.similar(first.id), [third.id, second.id]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.filter(recipe=second).delete()
+            IngredientRecipe.objects.create(
+                recipe=second, ingredient=self.ingredients[3], amount=1
+            )
+        self.assertEqual(recipe_index.similar(first.id), [third.id])
+        self.assertEqual(
+            recipe_index.match_pantry([self.ingredients[3].id]), [second.id]
+        )
+
+    def test_filtered_pantry(self):
+        other = create_user('other')
+        with self.captureOnCommitCallbacks(execute=True):
+            own, = create_recipes(
+                [other], [self.tag], self.ingredients, 1, 2,
+                prefix='Чужой рецепт'
+            )
+            invalidate_recipe_index()
+        response = APIClient().get('/api/recipes/pantry/', {
+            'ingredients': [item.id for item in self.ingredients[:2]],
+            'author': other.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']], [own.id]
+        )
+
+
+class RelationToggleTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipes = create_recipes(
+            [cls.author], [], [cls.ingredient], 3, 1
+        )
+        cls.missing_id = cls.recipes[-1].id + 100
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_toggle(self, url, missing_url):
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertEqual(self.client.post(missing_url).status_code, 404)
+
+    def test_recipe_toggles(self):
+        for action in ('favorite', 'shopping_cart'):
+            with self.subTest(action=action):
+                self.assert_toggle(
+                    f'/api/recipes/{self.recipes[0].id}/{action}/',
+                    f'/api/recipes/{self.missing_id}/{action}/'
+                )
+
+    def test_subscribe_toggle(self):
+        self.assert_toggle(
+            f'/api/users/{self.author.id}/subscribe/',
+            f'/api/users/{self.author.id + 100}/subscribe/'
+        )
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_recipe_bulk(self):
+        first, second, third = (recipe.id for recipe in self.recipes)
+        for action in ('favorite', 'shopping_cart'):
+            with self.subTest(action=action):
+                url = f'/api/recipes/{action}/'
+                response = self.client.post(
+                    url, {'ids': [first]}, format='json'
+                )
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data['added'], [first])
+                response = self.client.post(
+                    url, {'ids': [first, second, second]}, format='json'
+                )
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data['added'], [second])
+                response = self.client.post(
+                    url, {'ids': [third, self.missing_id]}, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+                response = self.client.delete(
+                    url, {'ids': [first, second, third]}, format='json'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertCountEqual(
+                    response.data['removed'], [first, second]
+                )
+        self.assertFalse(ShoppingListItem.objects.filter(user=self.user))
+
+    def test_subscribe_bulk(self):
+        url = '/api/users/subscribe/'
+        response = self.client.post(
+            url, {'ids': [self.author.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            url, {'ids': [self.author.id, self.user.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url, {'ids': [self.author.id]}, format='json'
+        )
+        self.assertEqual(response.data['added'], [])
+        response = self.client.delete(
+            url, {'ids': [self.author.id]}, format='json'
+        )
+        self.assertEqual(response.data['removed'], [self.author.id])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentRelationToggleTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.author = create_user('author')
+        self.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        self.recipes = create_recipes(
+            [self.author], [], [self.ingredient], 2, 1
+        )
+
+    def fire(self, method, url, data=None):
+        return self.fire_many(
+            [(self.user, method, url, data)] * CONCURRENT_REQUESTS
+        )
+
+    def fire_many(self, requests):
+        barrier = threading.Barrier(len(requests))
+        responses = []
+        lock = threading.Lock()
+
+        def send(user, method, url, data):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                response = getattr(client, method)(url, data, format='json')
+            except Exception:
+                response = None
+            finally:
+                connections.close_all()
+            with lock:
+                responses.append(response)
+
+        threads = [
+            threading.Thread(target=send, args=request)
+            for request in requests
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertNotIn(None, responses)
+        return responses
+
+    def assert_single_create(self, url):
+        statuses = Counter(
+            response.status_code for response in self.fire('post', url)
+        )
+        self.assertEqual(
+            statuses, Counter({201: 1, 400: CONCURRENT_REQUESTS - 1})
+        )
+
+    def test_duplicate_posts(self):
+        recipe = self.recipes[0]
+        self.assert_single_create(f'/api/recipes/{recipe.id}/favorite/')
+        self.assert_single_create(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assert_single_create(f'/api/users/{self.author.id}/subscribe/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.carts_count, 1)
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(
+            list(ShoppingListItem.objects
+                 .filter(user=self.user)
+                 .values_list('ingredient', 'amount')),
+            [(self.ingredient.id, 5)]
+        )
+
+    def test_duplicate_bulk_posts(self):
+        ids = [recipe.id for recipe in self.recipes]
+        for action in ('favorite', 'shopping_cart'):
+            with self.subTest(action=action):
+                responses = self.fire(
+                    'post', f'/api/recipes/{action}/', {'ids': ids}
+                )
+                self.assertEqual(
+                    {response.status_code for response in responses}, {201}
+                )
+                self.assertCountEqual(
+                    [recipe_id for response in responses
+                     for recipe_id in response.data['added']],
+                    ids
+                )
+        self.assertEqual(
+            list(ShoppingListItem.objects
+                 .filter(user=self.user)
+                 .values_list('ingredient', 'amount')),
+            [(self.ingredient.id, 10)]
+        )
+        self.assertEqual(
+            set(Recipe.objects.values_list('favorites_count', 'carts_count')),
+            {(1, 1)}
+        )
+
+    def test_edit_during_cart_adds(self):
+        recipe = self.recipes[0]
+        tag = Tag.objects.create(name='Тег', slug='tag')
+        for amount in range(6, 6 + EDIT_ROUNDS):
+            with self.subTest(amount=amount):
+                users = [
+                    create_user(f'buyer{amount}-{number}')
+                    for number in range(CONCURRENT_REQUESTS - 1)
+                ]
+                responses = self.fire_many([
+                    (user, 'post',
+                     f'/api/recipes/{recipe.id}/shopping_cart/', None)
+                    for user in users
+                ] + [(self.author, 'patch', f'/api/recipes/{recipe.id}/', {
+                    'name': recipe.name,
+                    'text': recipe.text,
+                    'cooking_time': recipe.cooking_time,
+                    'tags': [tag.id],
+                    'ingredients': [
+                        {'id': self.ingredient.id, 'amount': amount}
+                    ],
+                })])
+                self.assertEqual(
+                    Counter(response.status_code for response in responses),
+                    Counter({201: len(users), 200: 1})
+                )
+                self.assertEqual(
+                    ShoppingListItem.objects.diff_with_live(), {}
+                )
+
+
+class TokenCacheInvalidationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.other = create_user('other')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}'
+        )
+        self.other_token = Token.objects.create(user=self.other)
+
+    def assert_cached(self, cached):
+        hits = token_cache.stats()['hits']
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertEqual(token_cache.stats()['hits'] - hits, int(cached))
+
+    def test_other_users_changes_keep_entry(self):
+        self.assert_cached(False)
+        self.assert_cached(True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.set_password('new-password')
+            self.other.save()
+            self.other.is_active = False
+            self.other.save(update_fields=['is_active'])
+            self.other_token.delete()
+            self.user.first_name = 'Новое имя'
+            self.user.save()
+        self.assert_cached(True)
+
+    def test_credentials_change_drops_entry(self):
+        self.assert_cached(False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new-password')
+            self.user.save()
+        self.assert_cached(False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_token_destroy_drops_entry(self):
+        self.assert_cached(False)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_unknown_token_keeps_cache_clean(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token unknown')
+        self.assertEqual(client.get('/api/users/me/').status_code, 401)
+        self.assertIsNone(cache.get(token_auth_version('unknown')))
+
+
+class AuthorChangesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.recipe, = create_recipes([cls.author], [], [], 1, 0)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_bumped(self, bumped, change):
+        version = get_version(RECIPES_VERSION)
+        updated_at = Recipe.objects.get(id=self.recipe.id).updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertEqual(get_version(RECIPES_VERSION) != version, bumped)
+        self.assertEqual(
+            Recipe.objects.get(id=self.recipe.id).updated_at != updated_at,
+            bumped
+        )
+
+    def test_unrelated_saves_keep_version(self):
+        author = User.objects.get(id=self.author.id)
+        reader = User.objects.get(id=self.reader.id)
+
+        def login():
+            author.last_login = timezone.now()
+            author.save(update_fields=['last_login'])
+
+        def change_password():
+            author.set_password('new-password')
+            author.save()
+
+        def rename_reader():
+            reader.first_name = 'Новое имя'
+            reader.save()
+
+        for change in (lambda: create_user('newcomer'), login,
+                       change_password, rename_reader, author.save):
+            with self.subTest(change=change.__name__):
+                self.assert_bumped(False, change)
+
+    def test_author_rename_bumps_version(self):
+        author = User.objects.get(id=self.author.id)
+
+        def rename():
+            author.first_name = 'Новое имя'
+            author.save(update_fields=['first_name'])
+
+        self.assert_bumped(True, rename)
+
+
+class ShoppingListSyncTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.buyer = create_user('buyer')
+        cls.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            first_name='Админ',
+            last_name='Админ',
+            password='test-password'
+        )
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.flour, cls.sugar, cls.salt = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Сахар', 'Соль')
+        )
+        cls.recipe, = create_recipes(
+            [cls.author], [cls.tag], [cls.flour, cls.sugar], 1, 2
+        )
+        Cart.objects.add(cls.buyer, [cls.recipe.id])
+
+    def assert_shopping_list(self, expected):
+        self.assertEqual(
+            dict(ShoppingListItem.objects
+                 .filter(user=self.buyer)
+                 .values_list('ingredient', 'amount')),
+            expected
+        )
+        self.assertEqual(ShoppingListItem.objects.diff_with_live(), {})
+
+    def test_api_update(self):
+        self.assert_shopping_list({self.flour.id: 5, self.sugar.id: 5})
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.patch(f'/api/recipes/{self.recipe.id}/', {
+            'name': self.recipe.name,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': self.flour.id, 'amount': 7},
+                {'id': self.salt.id, 'amount': 2},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_shopping_list({self.flour.id: 7, self.salt.id: 2})
+
+    def test_admin_inline_edit(self):
+        flour_row, sugar_row = IngredientRecipe.objects.filter(
+            recipe=self.recipe
+        ).order_by('ingredient__name')
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            f'/admin/recipe/recipe/{self.recipe.id}/change/',
+            {
+                'name': self.recipe.name,
+                'author': self.author.id,
+                'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                'tags': [self.tag.id],
+                'ingredientrecipe-TOTAL_FORMS': 3,
+                'ingredientrecipe-INITIAL_FORMS': 2,
+                'ingredientrecipe-MIN_NUM_FORMS': 0,
+                'ingredientrecipe-MAX_NUM_FORMS': 1000,
+                'ingredientrecipe-0-id': flour_row.id,
+                'ingredientrecipe-0-recipe': self.recipe.id,
+                'ingredientrecipe-0-ingredient': self.flour.id,
+                'ingredientrecipe-0-amount': 9,
+                'ingredientrecipe-1-id': sugar_row.id,
+                'ingredientrecipe-1-recipe': self.recipe.id,
+                'ingredientrecipe-1-ingredient': self.sugar.id,
+                'ingredientrecipe-1-amount': 5,
+                'ingredientrecipe-1-DELETE': 'on',
+                'ingredientrecipe-2-recipe': self.recipe.id,
+                'ingredientrecipe-2-ingredient': self.salt.id,
+                'ingredientrecipe-2-amount': 4,
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_shopping_list({self.flour.id: 9, self.salt.id: 4})
+
+    def test_stale_instance_keeps_counters(self):
+        stale = Recipe.objects.get(id=self.recipe.id)
+        Favorite.objects.add(self.buyer, [self.recipe.id])
+        serializer = RecipeCreateSerializer(
+            stale,
+            data={
+                'name': 'Новое название',
+                'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.flour.id, 'amount': 5}],
+            },
+            partial=True,
+            context={'request': SimpleNamespace(method='PATCH')}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        stale = Recipe.objects.get(id=self.recipe.id)
+        Cart.objects.remove(self.buyer, [self.recipe.id])
+        admin.site._registry[Recipe].save_model(
+            None, stale, SimpleNamespace(changed_data=['text', 'tags']), True
+        )
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.carts_count), (1, 0)
+        )
+
+
+class SubscriptionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = [create_user(f'author{number}') for number in range(3)]
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.recipes = create_recipes(cls.authors, [cls.tag], [], 9, 0)
+        Follow.objects.add(cls.user, [author.id for author in cls.authors[:2]])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_subscriptions(self):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        for author, data in zip(self.authors, response.data['results']):
+            with self.subTest(author=author.username):
+                self.assertEqual(data['id'], author.id)
+                self.assertTrue(data['is_subscribed'])
+                self.assertEqual(data['recipes_count'], 3)
+                self.assertEqual(
+                    [recipe['id'] for recipe in data['recipes']],
+                    sorted((recipe.id for recipe in self.recipes
+                            if recipe.author_id == author.id),
+                           reverse=True)[:2]
+                )
+
+    def feed_ids(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_feed(self):
+        for min_follows in (1000, 1):
+            with self.subTest(min_follows=min_follows), override_settings(
+                FEED_INBOX_MIN_FOLLOWS=min_follows
+            ):
+                followed = {author.id for author in self.authors[:2]}
+                self.assertEqual(self.feed_ids(), sorted(
+                    (recipe.id for recipe in self.recipes
+                     if recipe.author_id in followed),
+                    reverse=True
+                ))
+                with self.captureOnCommitCallbacks(execute=True):
+                    Follow.objects.remove(self.user, [self.authors[0].id])
+                self.assertEqual(self.feed_ids(), sorted(
+                    (recipe.id for recipe in self.recipes
+                     if recipe.author_id == self.authors[1].id),
+                    reverse=True
+                ))
+                Follow.objects.add(self.user, [self.authors[0].id])
+
+
+class RecipeSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        beet = Ingredient.objects.create(name='Свекла', measurement_unit='г')
+        cls.soup, = create_recipes([cls.author], [], [beet], 1, 1, 'Борщ')
+        cls.salad, = create_recipes([cls.author], [], [beet], 1, 1, 'Салат')
+        create_recipes([cls.author], [], [], 1, 0, 'Каша')
+        update_search_index()
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, value):
+        response = self.client.get('/api/recipes/', {'search': value})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_search(self):
+        self.assertEqual(self.search('борщ'), [self.soup.id])
+        self.assertEqual(
+            self.search('свекла'), [self.salad.id, self.soup.id]
+        )
+        self.assertEqual(self.search('пирог'), [])
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.flour = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipe, = create_recipes(
+            [cls.author], [cls.tag], [cls.flour], 1, 1
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def assert_not_modified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_list(self):
+        etag = self.assert_not_modified('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.add(self.author, [self.recipe.id])
+        response = self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+
+    def test_detail(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.assert_not_modified(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {
+                'name': 'Новое название',
+                'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.flour.id, 'amount': 5}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Новое название')
+
+
+class AnonymousResponseCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipe, = create_recipes([cls.author], [], [], 1, 0)
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, client, params=None):
+        response = client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_cached_until_version_bump(self):
+        anonymous = APIClient()
+        authenticated = APIClient()
+        authenticated.force_authenticate(self.author)
+        old_name = self.recipe.name
+        self.assertEqual(self.names(anonymous), [old_name])
+        Recipe.objects.filter(id=self.recipe.id).touch(name='Новое название')
+        self.assertEqual(self.names(anonymous), [old_name])
+        self.assertEqual(
+            self.names(anonymous, {'is_favorited': 0}), ['Новое название']
+        )
+        self.assertEqual(self.names(authenticated), ['Новое название'])
+        bump_version(RECIPES_VERSION)
+        self.assertEqual(self.names(anonymous), ['Новое название'])
+
+
+class IngredientImportTest(TestCase):
+
+    def import_file(self, suffix, content):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf-8'
+        ) as file:
+            file.write(content)
+            file.flush()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command(
+                    'import_ingredients', file.name, stdout=StringIO()
+                )
+
+    def stored(self):
+        return set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+
+    def test_formats(self):
+        self.import_file('.csv', 'Мука,г\nСоль,г\n')
+        self.import_file(
+            '.json', '[{"name": "Мука", "measurement_unit": "г"}, '
+            '{"name": "Сахар", "measurement_unit": "г"}]'
+        )
+        self.import_file(
+            '.ndjson', '{"name": "Молоко", "measurement_unit": "мл"}\n'
+        )
+        self.assertEqual(self.stored(), {
+            ('Мука', 'г'), ('Соль', 'г'), ('Сахар', 'г'), ('Молоко', 'мл')
+        })
+        response = self.client.get('/api/ingredients/', {'name': 'мол'})
+        self.assertEqual(
+            [item['name'] for item in response.data], ['Молоко']
+        )
+
+    def test_invalid_json(self):
+        with self.assertRaises(CommandError):
+            self.import_file('.json', '[{"name": "Мука"')
+        self.assertEqual(self.stored(), set())
@@ -5,6 +5,7 @@ from api.views import (
     IngredientViewSet,
     RecipeViewSet,
     TagViewSet,
+    TokenCacheStatsView,
     UserViewSet
 )
 
@@ -18,5 +19,6 @@ routers.register('users', UserViewSet, basename='users')
 urlpatterns = [
     path('', include(routers.urls)),
     path('', include('djoser.urls')),
+    path('auth/token/cache/', TokenCacheStatsView.as_view()),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,19 +1,34 @@
-from django.db.models import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import (
+    BooleanField,
+    Count,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value
+)
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from recipe.models import (
     Cart,
     Favorite,
+    FeedInbox,
+    FeedItem,
     Follow,
     Ingredient,
-    IngredientRecipe,
     Recipe,
+    ShoppingListItem,
     Tag
 )
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
 from users.models import User
@@ -25,50 +40,146 @@ from api.serializers import (
     IngredientSerializer,
     RecipeCreateSerializer,
     RecipeSerializer,
+    RelationIdsSerializer,
     TagSerializer
 )
-from .paginator import CartPaginator, CustomPaginator
+from .async_views import AsyncReadMixin
+from .authentication import token_cache
+from .cache import AnonymousResponseCacheMixin, ConditionalGetMixin
+from .paginator import (
+    CartPaginator,
+    CustomPaginator,
+    KeysetPaginator,
+    ListPaginator
+)
+from .relations import get_relations, refresh_relations_on_commit
 
 from .filters import RecipeFilter
+from .fragments import FRAGMENT_FIELDS, RecipeFragmentMixin, render_recipes
+from .ingredient_index import ingredient_index
+from .recipe_index import recipe_index
+from .shopping_list import (
+    SHOPPING_LIST_FILENAME,
+    SHOPPING_LIST_FORMATS,
+    IgnoreFormatContentNegotiation
+)
 from .permissions import AdminOrAuthorOrReadOnly
 
 
+def relation_ids(request, targets):
+    serializer = RelationIdsSerializer(
+        data=request.data,
+        context={'targets': targets if request.method == 'POST' else None}
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
+
+
+def bulk_relations(request, model, ids):
+    user = request.user
+    if request.method == 'POST':
+        added = model.objects.add(user, ids)
+        refresh_relations_on_commit(user.id)
+        return Response({'added': added}, status=status.HTTP_201_CREATED)
+    removed = model.objects.remove(user, ids)
+    refresh_relations_on_commit(user.id)
+    return Response({'removed': removed})
+
+
 class UserViewSet(UserViewSet):
     queryset = User.objects.all()
+    lookup_value_regex = r'\d+'
     serializer_class = CustomUserSerializer
+    pagination_class = CustomPaginator
+
+    def _get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is None:
+            return None
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            raise ValidationError(
+                {'recipes_limit': 'Должно быть целым числом.'}
+            )
+        if recipes_limit < 0:
+            raise ValidationError(
+                {'recipes_limit': 'Не может быть отрицательным.'}
+            )
+        return recipes_limit
+
+    def _subscriptions_queryset(self):
+        recipes = Recipe.objects.only('id', 'name', 'image', 'image_variants',
+                                      'cooking_time', 'author_id')
+        recipes_limit = self._get_recipes_limit()
+        if recipes_limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects
+                .filter(author_id=OuterRef('author_id'))
+                .order_by('-id')
+                .values('id')[:recipes_limit]
+            ))
+        return (
+            User.objects
+            .filter(following__user=self.request.user)
+            .annotate(
+                is_subscribed=Value(True, output_field=BooleanField()),
+                recipes_count=Count('recipes', distinct=True)
+            )
+            .prefetch_related(
+                Prefetch('recipes', queryset=recipes, to_attr='recipes_list')
+            )
+            .order_by('id')
+        )
 
     @action(detail=True,
             methods=['post', 'delete'])
     def subscribe(self, request, id):
         user = self.request.user
-        author = get_object_or_404(User, id=id)
-        follow_exists = Follow.objects.filter(user=user, author=author)
+        author_id = int(id)
         if request.method == 'POST':
-            if user == author:
+            if user.id == author_id:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            if not follow_exists.exists():
-                Follow.objects.create(user=user, author=author)
-                serializer = FollowSerializer(
-                    author, context={'request': request}
-                )
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            else:
+            try:
+                created = Follow.objects.add_one(user, author_id)
+            except IntegrityError:
+                created = False
+            if not created:
+                get_object_or_404(User, id=author_id)
                 return Response(status=status.HTTP_400_BAD_REQUEST)
+            refresh_relations_on_commit(user.id)
+            serializer = FollowSerializer(
+                self._subscriptions_queryset().get(id=author_id),
+                context={'request': request}
+            )
+            return Response(serializer.data,
+                            status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if follow_exists.exists():
-                follow_exists.delete()
+            if Follow.objects.remove(user, [author_id]):
+                refresh_relations_on_commit(user.id)
                 return Response(status=status.HTTP_204_NO_CONTENT)
-            else:
-                return Response(status=status.HTTP_404_NOT_FOUND)
+            return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='subscribe',
+            url_name='subscribe-bulk',
+            permission_classes=(IsAuthenticated,))
+    def subscribe_bulk(self, request):
+        ids = relation_ids(request, User.objects.all())
+        if request.method == 'POST' and request.user.id in ids:
+            return Response(
+                {'ids': 'Вы не можете подписаться на себя!'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return bulk_relations(request, Follow, ids)
+
     @action(detail=False,
             methods=['get'])
     def subscriptions(self, request):
-        follow_list = User.objects.filter(following__user=request.user)
+        follow_list = self._subscriptions_queryset()
         serializer = FollowSerializer(
             self.paginate_queryset(follow_list),
             many=True,
@@ -77,25 +188,39 @@ class UserViewSet(UserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(AsyncReadMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(ModelViewSet):
+class IngredientViewSet(AsyncReadMixin, ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(name))
 
-class RecipeViewSet(ModelViewSet):
+
+class RecipeViewSet(AsyncReadMixin,
+                    ConditionalGetMixin,
+                    AnonymousResponseCacheMixin,
+                    RecipeFragmentMixin,
+                    ModelViewSet):
     queryset = Recipe.objects.all()
+    lookup_value_regex = r'\d+'
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     permission_classes = (AdminOrAuthorOrReadOnly,)
     pagination_class = CustomPaginator
 
+    def get_queryset(self):
+        return Recipe.objects.all()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerializer
@@ -110,25 +235,28 @@ class RecipeViewSet(ModelViewSet):
                                    model_name,
                                    serializer_name):
         user = self.request.user
-        recipe = get_object_or_404(Recipe, id=pk)
-        case_name = model_name.objects.filter(user=user, recipe=recipe)
+        recipe_id = int(pk)
         if request.method == 'POST':
-            if not case_name.exists():
-                case_name = model_name.objects.create(user=user, recipe=recipe)
-                serializer = serializer_name(
-                    case_name, context={'request': request}
-                )
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            else:
+            try:
+                created = model_name.objects.add_one(user, recipe_id)
+            except IntegrityError:
+                created = False
+            if not created:
+                get_object_or_404(Recipe, id=recipe_id)
                 return Response(status=status.HTTP_400_BAD_REQUEST)
+            refresh_relations_on_commit(user.id)
+            serializer = serializer_name(
+                model_name(user=user, recipe_id=recipe_id),
+                context={'request': request}
+            )
+            return Response(serializer.data,
+                            status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if case_name.exists():
-                case_name.delete()
+            if model_name.objects.remove(user, [recipe_id]):
+                refresh_relations_on_commit(user.id)
                 return Response(status=status.HTTP_204_NO_CONTENT)
-            else:
-                return Response(status=status.HTTP_404_NOT_FOUND)
+            return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post', 'delete'])
@@ -153,28 +281,178 @@ class RecipeViewSet(ModelViewSet):
             CartSerializer
         )
 
-    @action(detail=False, methods=['get'])
-    def download_shopping_cart(self, request):
-        user = self.request.user
-        ingredients_list = (
-            IngredientRecipe.objects
-            .filter(recipe__cart_recipe__user=user)
-            .values('ingredient')
-            .annotate(amount_ingredient=Sum('amount'))
-            .values_list(
-                'ingredient__name',
-                'amount_ingredient',
-                'ingredient__measurement_unit'
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return bulk_relations(
+            request, Favorite, relation_ids(request, Recipe.objects.all())
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_bulk(self, request):
+        return bulk_relations(
+            request, Cart, relation_ids(request, Recipe.objects.all())
+        )
+
+    def _get_similar_limit(self):
+        limit = self.request.query_params.get('limit')
+        if limit is None:
+            return settings.SIMILAR_RECIPES_LIMIT
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Должно быть целым числом.'})
+        if not 1 <= limit <= settings.SIMILAR_RECIPES_MAX:
+            raise ValidationError({'limit': 'Должно быть от 1 до {}.'.format(
+                settings.SIMILAR_RECIPES_MAX
+            )})
+        return limit
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk):
+        similar = recipe_index.similar(int(pk), self._get_similar_limit())
+        if similar is None:
+            raise Http404
+        recipes = {
+            recipe.id: recipe
+            for recipe in Recipe.objects
+            .filter(id__in=similar)
+            .only(*FRAGMENT_FIELDS)
+        }
+        return Response(render_recipes(
+            [recipes[recipe_id] for recipe_id in similar
+             if recipe_id in recipes],
+            request
+        ))
+
+    def _get_pantry(self):
+        params = self.request.query_params
+        try:
+            ingredient_ids = {
+                int(value) for value in params.getlist('ingredients')
+            }
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Должны быть целыми числами.'}
+            )
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент.'}
             )
+        if len(ingredient_ids) > settings.PANTRY_MAX_INGREDIENTS:
+            raise ValidationError({'ingredients': 'Не больше {}.'.format(
+                settings.PANTRY_MAX_INGREDIENTS
+            )})
+        try:
+            max_missing = int(params.get('missing', 0))
+        except ValueError:
+            raise ValidationError({'missing': 'Должно быть целым числом.'})
+        if max_missing < 0:
+            raise ValidationError({'missing': 'Не может быть отрицательным.'})
+        return ingredient_ids, max_missing
+
+    @action(detail=False, methods=['get'], pagination_class=ListPaginator)
+    def pantry(self, request):
+        ingredient_ids, max_missing = self._get_pantry()
+        matches = recipe_index.match_pantry(ingredient_ids, max_missing)
+        queryset = self.filter_queryset(self.get_queryset())
+        if matches and queryset.query.has_filters():
+            allowed = set(
+                queryset.filter(id__in=matches).values_list('id', flat=True)
+            )
+            matches = [
+                recipe_id for recipe_id in matches if recipe_id in allowed
+            ]
+        page = self.paginate_queryset(matches)
+        missing = recipe_index.missing_ingredients(page, ingredient_ids)
+        recipes = {
+            recipe.id: recipe
+            for recipe in Recipe.objects
+            .filter(id__in=page)
+            .only(*FRAGMENT_FIELDS)
+        }
+        data = render_recipes(
+            [recipes[recipe_id] for recipe_id in page
+             if recipe_id in recipes],
+            request
         )
+        for item in data:
+            item['missing_ingredients'] = missing.get(item['id'], [])
+        return self.get_paginated_response(data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,),
+        pagination_class=KeysetPaginator
+    )
+    def feed(self, request):
+        user = request.user
+        follows = get_relations(request).follows
+        recipes = Recipe.objects.only(*FRAGMENT_FIELDS).order_by('-id')
+        if not 0 < settings.FEED_INBOX_MIN_FOLLOWS <= len(follows):
+            page = self.paginate_queryset(
+                recipes.filter(author__following__user=user)
+            )
+            return self.get_paginated_response(render_recipes(page, request))
+        FeedInbox.objects.sync(user, follows)
+        page = [
+            item.recipe_id for item in self.paginate_queryset(
+                FeedItem.objects.filter(user=user)
+                .only('recipe_id')
+                .order_by('-recipe_id')
+            )
+        ]
+        recipes = recipes.in_bulk(page)
+        return self.get_paginated_response(render_recipes(
+            [recipes[recipe_id] for recipe_id in page
+             if recipe_id in recipes],
+            request
+        ))
 
-        shopping_list = []
-        for ingredient in ingredients_list:
-            shopping_list.append('{} - {} {}\n'.format(*ingredient))
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=IgnoreFormatContentNegotiation
+    )
+    def download_shopping_cart(self, request):
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'format': 'Допустимые форматы: {}.'.format(
+                    ', '.join(SHOPPING_LIST_FORMATS)
+                )},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_type, render = SHOPPING_LIST_FORMATS[file_format]
 
-        file_shopping_list = HttpResponse(shopping_list,
-                                          content_type='text/plain')
-        file_shopping_list['Content-Disposition'] = ('attachment; \
-                                                     filename={file}.txt')
-        Cart.objects.filter(user=user).delete()
+        ingredients_list = ShoppingListItem.objects.take(self.request.user)
+        file_shopping_list = StreamingHttpResponse(
+            render(ingredients_list),
+            content_type=content_type
+        )
+        file_shopping_list['Content-Disposition'] = (
+            'attachment; filename="{}.{}"'.format(
+                SHOPPING_LIST_FILENAME, file_format
+            )
+        )
         return file_shopping_list
+
+
+class TokenCacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(token_cache.stats())
@@ -0,0 +1,14 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    from django.conf import settings
+
+    if server.cfg.workers > 1 and not settings.CACHE_SHARED:
+        raise ImproperlyConfigured(
+            'Для нескольких воркеров нужен общий для всех воркеров '
+            'CACHE_BACKEND (Memcached или DatabaseCache).'
+        )
@@ -1,40 +1,116 @@
 from django.contrib import admin
 
+from recipe.images import process_recipe_image
 from recipe.models import (
     Favorite,
     Follow,
     Ingredient,
     IngredientRecipe,
     Recipe,
+    ShoppingListItem,
     Tag
 )
 
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+    search_fields = ('user__username__startswith',)
+    show_full_result_count = False
 
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    search_fields = (
+        'user__username__startswith',
+        'author__username__startswith'
+    )
+    show_full_result_count = False
 
 
-class IngredientRecipeInLine(admin.StackedInline):
+class IngredientRecipeInLine(admin.TabularInline):
     model = IngredientRecipe
+    autocomplete_fields = ('ingredient',)
     extra = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('name', 'slug', 'color')
+    search_fields = ('name', 'slug')
+
+
+class TagListFilter(admin.SimpleListFilter):
+    title = 'Теги'
+    parameter_name = 'tag'
+
+    def lookups(self, request, model_admin):
+        return Tag.objects.values_list('id', 'name')
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+            tag_id=self.value()
+        ).values('recipe_id'))
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [IngredientRecipeInLine]
+    list_display = ('name', 'author', 'favorites_count', 'carts_count')
+    list_select_related = ('author',)
+    list_filter = (TagListFilter,)
+    autocomplete_fields = ('author', 'tags')
+    readonly_fields = ('favorites_count', 'carts_count')
+    search_fields = ('name',)
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        Recipe.objects.filter(id=obj.id).lock()
+        concrete = {field.name for field in Recipe._meta.concrete_fields}
+        update_fields = [
+            name for name in form.changed_data if name in concrete
+        ]
+        if 'image' in update_fields:
+            obj.image_variants = {}
+            update_fields.append('image_variants')
+        obj.save(update_fields=[*update_fields, 'updated_at'])
+        if 'image' in update_fields:
+            process_recipe_image(obj)
+
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        Recipe.objects.filter(id=recipe.id).lock()
+        old_amounts = ShoppingListItem.objects.recipe_amounts(recipe)
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.change_recipe(
+            recipe,
+            old_amounts,
+            ShoppingListItem.objects.recipe_amounts(recipe)
+        )
+        Recipe.objects.filter(id=recipe.id).touch()
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('name', 'measurement_unit')
+    search_fields = ('^name',)
+    ordering = ('name',)
+    show_full_result_count = False
@@ -0,0 +1,111 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipe.versions import RECIPES_VERSION, bump_version
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZES = {
+    'thumbnail': (320, 320),
+    'card': (720, 720),
+    'full': (1600, 1600),
+}
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def _init_worker():
+    django.setup()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+    return _executor
+
+
+def _to_rgb(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(name):
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        image = _to_rgb(ImageOps.exif_transpose(image))
+    stem = name.rsplit('.', 1)[0]
+    variants = {}
+    for size, box in IMAGE_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        variants[size] = {}
+        for extension, (image_format, options) in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            variants[size][extension] = default_storage.save(
+                f'{stem}_{size}.{extension}',
+                ContentFile(buffer.getvalue())
+            )
+    return variants
+
+
+def _store_variants(recipe_id, name, variants):
+    from recipe.models import Recipe
+
+    if Recipe.objects.filter(id=recipe_id, image=name).update(
+        image_variants=variants,
+        updated_at=timezone.now()
+    ):
+        bump_version(RECIPES_VERSION)
+
+
+def _variants_done(recipe_id, name, future):
+    try:
+        _store_variants(recipe_id, name, future.result())
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        connection.close()
+
+
+def _submit(recipe_id, name):
+    try:
+        if not settings.IMAGE_PROCESSING_WORKERS:
+            _store_variants(recipe_id, name, render_variants(name))
+            return
+        future = get_executor().submit(render_variants, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+        return
+    future.add_done_callback(partial(_variants_done, recipe_id, name))
+
+
+def process_recipe_image(recipe):
+    if recipe.image:
+        transaction.on_commit(
+            partial(_submit, recipe.id, recipe.image.name)
+        )
@@ -1,10 +1,20 @@
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.utils import timezone
 from foodgram.constants import FIXED_STRING_LENGTH
 from users.models import User
 
+from recipe.search import search_recipes
+from recipe.versions import bump_version_on_commit, user_relations_version
+
 
 class Ingredient(models.Model):
     name = models.CharField(
@@ -19,6 +29,12 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='ingredient_name_unit_unique'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -47,6 +63,92 @@ class Tag(models.Model):
         return self.name
 
 
+TAGS_MASK_BITS = 63
+
+
+def tags_mask(tag_ids):
+    mask = 0
+    for tag_id in tag_ids:
+        if tag_id < TAGS_MASK_BITS:
+            mask |= 1 << tag_id
+    return mask
+
+
+POPULAR_ORDERING = ('-favorites_count', '-id')
+FEED_BATCH_SIZE = 1000
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def touch(self, **fields):
+        return self.update(updated_at=timezone.now(), **fields)
+
+    def lock(self):
+        return set(
+            self.select_for_update()
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+    def search(self, value):
+        return search_recipes(self, value)
+
+    def popular(self):
+        return self.order_by(*POPULAR_ORDERING)
+
+    def _live_counters(self, recipe_ids):
+        counters = defaultdict(dict)
+        for model in (Favorite, Cart):
+            for recipe_id, count in (
+                model.objects
+                .filter(recipe_id__in=recipe_ids)
+                .values('recipe_id')
+                .annotate(count=models.Count('id'))
+                .order_by()
+                .values_list('recipe_id', 'count')
+            ):
+                counters[recipe_id][model.counter_field] = count
+        return counters
+
+    def sync_counters(self, batch_size=1000, dry_run=False):
+        fields = (Favorite.counter_field, Cart.counter_field)
+        drift = {}
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                recipes = self.order_by('id').filter(id__gt=last_id)
+                if not dry_run:
+                    recipes = recipes.select_for_update()
+                recipes = list(recipes.only('id', *fields)[:batch_size])
+                if not recipes:
+                    return drift
+                last_id = recipes[-1].id
+                counters = self._live_counters(
+                    [recipe.id for recipe in recipes]
+                )
+                changed = []
+                for recipe in recipes:
+                    live = counters.get(recipe.id, {})
+                    stored = tuple(getattr(recipe, field) for field in fields)
+                    actual = tuple(live.get(field, 0) for field in fields)
+                    if stored != actual:
+                        drift[recipe.id] = (stored, actual)
+                        for field, value in zip(fields, actual):
+                            setattr(recipe, field, value)
+                        changed.append(recipe)
+                if not dry_run:
+                    self.bulk_update(changed, fields)
+
+    def with_related(self):
+        return self.prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredientrecipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            )
+        )
+
+
 class Recipe(models.Model):
     name = models.CharField(
         max_length=FIXED_STRING_LENGTH,
@@ -82,11 +184,53 @@ class Recipe(models.Model):
         default=None,
         verbose_name='Изображение'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения'
+    )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тегов'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый индекс'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = (
+            models.Index(
+                fields=POPULAR_ORDERING,
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_id_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -118,6 +262,135 @@ class IngredientRecipe(models.Model):
         return str(self.ingredient)
 
 
+_pending_counters = threading.local()
+
+
+@contextmanager
+def coalesced_counters():
+    if getattr(_pending_counters, 'deltas', None) is not None:
+        yield
+        return
+    _pending_counters.deltas = defaultdict(int)
+    try:
+        yield
+        deltas = _pending_counters.deltas
+    finally:
+        _pending_counters.deltas = None
+    grouped = defaultdict(list)
+    for (model, target_id), delta in deltas.items():
+        if delta:
+            grouped[model, delta].append(target_id)
+    for (model, delta), target_ids in grouped.items():
+        model.objects.change_counters(target_ids, delta)
+
+
+def _lock_users(user_ids):
+    list(User.objects.select_for_update()
+         .filter(id__in=user_ids)
+         .order_by('id')
+         .values_list('id', flat=True))
+
+
+class UserRelationQuerySet(models.QuerySet):
+
+    def _target(self, user, target_ids):
+        return self.filter(user=user, **{
+            f'{self.model.relation_target}_id__in': target_ids
+        })
+
+    def change_counters(self, target_ids, delta):
+        field = self.model.counter_field
+        if field is None or not target_ids:
+            return
+        deltas = getattr(_pending_counters, 'deltas', None)
+        if deltas is not None:
+            for target_id in target_ids:
+                deltas[self.model, target_id] += delta
+            return
+        recipes = Recipe.objects.filter(id__in=target_ids)
+        if delta < 0:
+            recipes = recipes.filter(**{f'{field}__gte': -delta})
+        recipes.update(**{field: models.F(field) + delta})
+
+    def _supports_returning(self):
+        return connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite'
+            and sqlite3.sqlite_version_info >= (3, 35)
+        )
+
+    def _insert_returning(self, user, target_ids):
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        target = meta.get_field(self.model.relation_target)
+        target_meta = target.related_model._meta
+        column = quote(target.column)
+        pk = quote(target_meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(meta.db_table)} '
+                f'({quote(meta.get_field("user").column)}, {column}) '
+                f'SELECT %s, {pk} FROM {quote(target_meta.db_table)} '
+                f'WHERE {pk} IN ({", ".join(["%s"] * len(target_ids))}) '
+                f'ORDER BY {pk} '
+                f'ON CONFLICT DO NOTHING RETURNING {column}',
+                [user.id, *target_ids]
+            )
+            return {target_id for target_id, in cursor.fetchall()}
+
+    def _insert_missing(self, user, target_ids):
+        field = f'{self.model.relation_target}_id'
+        _lock_users([user.id])
+        found = set(
+            self.model._meta.get_field(self.model.relation_target)
+            .related_model.objects
+            .filter(id__in=target_ids)
+            .values_list('id', flat=True)
+        )
+        found -= set(
+            self._target(user, target_ids).values_list(field, flat=True)
+        )
+        self.bulk_create(
+            [self.model(user=user, **{field: target_id})
+             for target_id in found],
+            ignore_conflicts=True
+        )
+        return found
+
+    def add_one(self, user, target_id):
+        return bool(self.add(user, [target_id]))
+
+    def add(self, user, target_ids):
+        target_ids = list(dict.fromkeys(target_ids))
+        if not target_ids:
+            return []
+        with transaction.atomic(savepoint=False):
+            if self._supports_returning():
+                inserted = self._insert_returning(user, target_ids)
+            else:
+                inserted = self._insert_missing(user, target_ids)
+            added = [
+                target_id for target_id in target_ids
+                if target_id in inserted
+            ]
+            self.change_counters(added, 1)
+            bump_version_on_commit(user_relations_version(user.id))
+        return added
+
+    def remove(self, user, target_ids):
+        field = f'{self.model.relation_target}_id'
+        with transaction.atomic():
+            if self.model.counter_field is not None:
+                Recipe.objects.filter(id__in=target_ids).lock()
+            _lock_users([user.id])
+            removed = list(
+                self._target(user, target_ids).values_list(field, flat=True)
+            )
+            if removed:
+                with coalesced_counters():
+                    self._target(user, removed).delete()
+        return removed
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -136,6 +409,11 @@ class Follow(models.Model):
         verbose_name='Автор'
     )
 
+    relation_target = 'author'
+    counter_field = None
+
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -153,6 +431,107 @@ class Follow(models.Model):
             )
 
 
+class FeedInboxQuerySet(models.QuerySet):
+
+    def sync(self, user, author_ids):
+        follows_hash = hash(frozenset(author_ids))
+        if self.filter(user=user, follows_hash=follows_hash).exists():
+            return
+        with transaction.atomic():
+            inbox, _ = self.select_for_update().get_or_create(user=user)
+            if inbox.follows_hash == follows_hash:
+                return
+            items = FeedItem.objects.filter(user=user)
+            stored = set(
+                items.values_list('author_id', flat=True).distinct()
+            )
+            removed = stored - set(author_ids)
+            if removed:
+                items.filter(author_id__in=removed).delete()
+            added = set(author_ids) - stored
+            if added:
+                FeedItem.objects.bulk_create(
+                    [FeedItem(user=user, recipe_id=recipe_id,
+                              author_id=author_id)
+                     for recipe_id, author_id in Recipe.objects
+                     .filter(author_id__in=added)
+                     .values_list('id', 'author_id')
+                     .iterator()],
+                    batch_size=FEED_BATCH_SIZE,
+                    ignore_conflicts=True
+                )
+            inbox.follows_hash = follows_hash
+            inbox.save(update_fields=('follows_hash',))
+
+
+class FeedInbox(models.Model):
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='feed_inbox',
+        verbose_name='Пользователь'
+    )
+    follows_hash = models.BigIntegerField(
+        null=True,
+        verbose_name='Отпечаток подписок'
+    )
+
+    objects = FeedInboxQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Лента подписок'
+        verbose_name_plural = 'Ленты подписок'
+
+
+class FeedItemQuerySet(models.QuerySet):
+
+    def fan_out(self, recipe):
+        self.bulk_create(
+            [FeedItem(user_id=user_id, recipe=recipe,
+                      author_id=recipe.author_id)
+             for user_id in FeedInbox.objects
+             .filter(user__follower__author_id=recipe.author_id)
+             .values_list('user_id', flat=True)
+             .iterator()],
+            batch_size=FEED_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+
+class FeedItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+
+    objects = FeedItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Рецепты в ленте'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='feed_item_unique'
+            ),
+        )
+
+
 class FavoriteOrCartBaseModel(models.Model):
     user = models.ForeignKey(
         User,
@@ -171,6 +550,10 @@ class FavoriteOrCartBaseModel(models.Model):
         verbose_name='Рецепт'
     )
 
+    relation_target = 'recipe'
+
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         abstract = True
         constraints = (
@@ -183,13 +566,222 @@ class FavoriteOrCartBaseModel(models.Model):
 
 class Favorite(FavoriteOrCartBaseModel):
 
+    counter_field = 'favorites_count'
+
     class Meta(FavoriteOrCartBaseModel.Meta):
         verbose_name = 'Избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
 
 
+class CartQuerySet(UserRelationQuerySet):
+
+    def add(self, user, recipe_ids):
+        with transaction.atomic():
+            Recipe.objects.filter(id__in=recipe_ids).lock()
+            added = super().add(user, recipe_ids)
+            ShoppingListItem.objects.add_recipes(user, added)
+        return added
+
+    def remove(self, user, recipe_ids):
+        with transaction.atomic():
+            removed = super().remove(user, recipe_ids)
+            ShoppingListItem.objects.remove_recipes(user, removed)
+        return removed
+
+
 class Cart(FavoriteOrCartBaseModel):
 
+    counter_field = 'carts_count'
+
+    objects = CartQuerySet.as_manager()
+
     class Meta(FavoriteOrCartBaseModel.Meta):
         verbose_name = 'Товар в корзине'
         verbose_name_plural = 'Товары в корзине'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+
+    def _apply(self, deltas):
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        user_ids = {user_id for user_id, _ in deltas}
+        ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+        with transaction.atomic(savepoint=False):
+            _lock_users(user_ids)
+            existing = {
+                (item.user_id, item.ingredient_id): item
+                for item in self.filter(
+                    user_id__in=user_ids,
+                    ingredient_id__in=ingredient_ids
+                )
+            }
+            to_create, to_update, to_delete = [], [], []
+            for key, delta in deltas.items():
+                item = existing.get(key)
+                if item is None:
+                    if delta > 0:
+                        to_create.append(self.model(
+                            user_id=key[0],
+                            ingredient_id=key[1],
+                            amount=delta
+                        ))
+                    continue
+                item.amount += delta
+                if item.amount > 0:
+                    to_update.append(item)
+                else:
+                    to_delete.append(item.id)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ['amount'])
+            self.filter(id__in=to_delete).delete()
+
+    def _recipe_amounts(self, recipe_ids):
+        if not recipe_ids:
+            return {}
+        return dict(
+            IngredientRecipe.objects
+            .filter(recipe_id__in=recipe_ids)
+            .values('ingredient_id')
+            .annotate(total=models.Sum('amount'))
+            .order_by()
+            .values_list('ingredient_id', 'total')
+        )
+
+    def add_recipes(self, user, recipe_ids, sign=1):
+        self._apply({
+            (user.id, ingredient_id): sign * amount
+            for ingredient_id, amount in (
+                self._recipe_amounts(recipe_ids).items()
+            )
+        })
+
+    def remove_recipes(self, user, recipe_ids):
+        self.add_recipes(user, recipe_ids, sign=-1)
+
+    def recipe_amounts(self, recipe):
+        return self._recipe_amounts([recipe.id])
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        with transaction.atomic():
+            Recipe.objects.filter(id=recipe.id).lock()
+            user_ids = list(
+                Cart.objects.filter(recipe=recipe)
+                .values_list('user_id', flat=True)
+            )
+            if not user_ids:
+                return
+            changes = {
+                ingredient_id: (new_amounts.get(ingredient_id, 0)
+                                - old_amounts.get(ingredient_id, 0))
+                for ingredient_id in old_amounts.keys() | new_amounts.keys()
+            }
+            self._apply({
+                (user_id, ingredient_id): delta
+                for user_id in user_ids
+                for ingredient_id, delta in changes.items()
+            })
+
+    def delete_recipe(self, recipe):
+        with transaction.atomic():
+            Recipe.objects.filter(id=recipe.id).lock()
+            self.change_recipe(recipe, self.recipe_amounts(recipe), {})
+
+    def take(self, user):
+        with transaction.atomic():
+            Recipe.objects.filter(
+                id__in=Cart.objects.filter(user=user).values('recipe_id')
+            ).lock()
+            _lock_users([user.id])
+            items = self.filter(user=user)
+            shopping_list = list(
+                items
+                .order_by('ingredient__name')
+                .values_list(
+                    'ingredient__name',
+                    'amount',
+                    'ingredient__measurement_unit'
+                )
+            )
+            items.delete()
+            with coalesced_counters():
+                Cart.objects.filter(user=user).delete()
+        return shopping_list
+
+    def live_totals(self, user_ids=None):
+        if user_ids is None:
+            totals = IngredientRecipe.objects.filter(
+                recipe__cart_recipe__isnull=False
+            )
+        else:
+            totals = IngredientRecipe.objects.filter(
+                recipe__cart_recipe__user_id__in=user_ids
+            )
+        return (
+            totals
+            .values('recipe__cart_recipe__user', 'ingredient')
+            .annotate(total=models.Sum('amount'))
+            .order_by()
+            .values_list('recipe__cart_recipe__user', 'ingredient', 'total')
+        )
+
+    def diff_with_live(self):
+        stored = defaultdict(int)
+        for user_id, ingredient_id, amount in self.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ).iterator():
+            stored[user_id, ingredient_id] = amount
+        drift = {}
+        for user_id, ingredient_id, total in self.live_totals().iterator():
+            amount = stored.pop((user_id, ingredient_id), 0)
+            if amount != total:
+                drift[user_id, ingredient_id] = total - amount
+        for key, amount in stored.items():
+            drift[key] = -amount
+        return drift
+
+    def rebuild(self, batch_size=1000):
+        with transaction.atomic():
+            self.all().delete()
+            batch = []
+            for user_id, ingredient_id, total in (
+                self.live_totals().iterator()
+            ):
+                batch.append(self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=total
+                ))
+                if len(batch) >= batch_size:
+                    self.bulk_create(batch)
+                    batch = []
+            self.bulk_create(batch)
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='shopping_list_user_ingredient_unique'
+            ),
+        )
@@ -0,0 +1,166 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector
+)
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+SEARCH_TABLE = 'recipe_search'
+SEARCH_WEIGHTS = {'name': 10.0, 'ingredients': 5.0, 'text': 1.0}
+
+_pending = threading.local()
+
+
+def _search_vector():
+    from recipe.models import IngredientRecipe
+
+    ingredients = Subquery(
+        IngredientRecipe.objects
+        .filter(recipe=OuterRef('pk'))
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(ingredients, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS):
+    database = connections[using]
+    with database.cursor() as cursor:
+        if database.vendor == 'postgresql':
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS recipe_search_vector_gin '
+                'ON recipe_recipe USING gin (search_vector)'
+            )
+        elif database.vendor == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+                f'USING fts5({", ".join(SEARCH_WEIGHTS)}, '
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+
+
+def _fold(value):
+    return value.lower().replace('ё', 'е')
+
+
+def _sqlite_rows(recipe_ids):
+    from recipe.models import IngredientRecipe, Recipe
+
+    names = defaultdict(list)
+    for recipe_id, name in (
+        IngredientRecipe.objects
+        .filter(recipe_id__in=recipe_ids)
+        .values_list('recipe_id', 'ingredient__name')
+    ):
+        names[recipe_id].append(_fold(name))
+    return [
+        (recipe_id, _fold(name), ' '.join(names[recipe_id]), _fold(text))
+        for recipe_id, name, text in (
+            Recipe.objects
+            .filter(id__in=recipe_ids)
+            .values_list('id', 'name', 'text')
+        )
+    ]
+
+
+def update_search_index(recipe_ids=None, batch_size=1000):
+    from recipe.models import Recipe
+
+    if connection.vendor == 'postgresql':
+        recipes = Recipe.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(id__in=recipe_ids)
+        recipes.update(search_vector=_search_vector())
+        return
+    if connection.vendor != 'sqlite':
+        return
+    if recipe_ids is None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        recipe_ids = Recipe.objects.values_list('id', flat=True)
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN '
+                f'({", ".join(["%s"] * len(batch))})',
+                batch
+            )
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} '
+                f'(rowid, {", ".join(SEARCH_WEIGHTS)}) '
+                'VALUES (%s, %s, %s, %s)',
+                _sqlite_rows(batch)
+            )
+
+
+def _pending_ids():
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    return _pending.ids
+
+
+def _flush_pending():
+    recipe_ids = _pending_ids()
+    if recipe_ids:
+        _pending.ids = set()
+        update_search_index(recipe_ids)
+
+
+def update_search_index_on_commit(recipe_ids):
+    _pending_ids().update(recipe_ids)
+    transaction.on_commit(_flush_pending)
+
+
+def _fts_query(value):
+    return ' '.join(
+        '"{}"*'.format(word) for word in re.findall(r'\w+', _fold(value))
+    )
+
+
+def search_recipes(queryset, value):
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return (
+            queryset
+            .filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F('search_vector'), query))
+            .order_by('-search_rank', '-id')
+        )
+    if connection.vendor != 'sqlite':
+        return queryset.filter(name__icontains=value)
+    match = _fts_query(value)
+    if not match:
+        return queryset.none()
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS.values())
+    return (
+        queryset
+        .filter(id__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s',
+            (match,)
+        ))
+        .annotate(search_rank=RawSQL(
+            f'SELECT -bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE}.rowid = recipe_recipe.id '
+            f'AND {SEARCH_TABLE} MATCH %s',
+            (match,)
+        ))
+        .order_by('-search_rank', '-id')
+    )
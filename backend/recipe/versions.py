@@ -0,0 +1,70 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db import transaction
+
+RECIPES_VERSION = 'recipes_version'
+TAGS_VERSION = 'tags_version'
+SNAPSHOT_VERSIONS = (
+    RECIPES_VERSION,
+    f'{RECIPES_VERSION}:modified',
+    TAGS_VERSION,
+)
+
+_snapshot = ContextVar('versions_snapshot', default=None)
+
+
+def user_relations_version(user_id):
+    return f'user_relations_version:{user_id}'
+
+
+def read_snapshot():
+    return cache.get_many(SNAPSHOT_VERSIONS)
+
+
+@contextmanager
+def versions_snapshot(snapshot):
+    token = _snapshot.set(snapshot)
+    try:
+        yield
+    finally:
+        _snapshot.reset(token)
+
+
+def get_version(key):
+    snapshot = _snapshot.get()
+    if snapshot is not None and key in snapshot:
+        return snapshot[key]
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    if snapshot is not None:
+        snapshot[key] = version
+    return version
+
+
+def get_last_modified(key):
+    snapshot = _snapshot.get()
+    key = f'{key}:modified'
+    if snapshot is not None and key in snapshot:
+        return snapshot[key]
+    return cache.get(key)
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+    cache.set(f'{key}:modified', int(time.time()) + 1, timeout=None)
+    snapshot = _snapshot.get()
+    if snapshot is not None:
+        snapshot.pop(key, None)
+        snapshot.pop(f'{key}:modified', None)
+
+
+def bump_version_on_commit(key):
+    transaction.on_commit(lambda: bump_version(key))